@@ -1,4 +1,5 @@
 import streamlit as st
+import comparison
 import handlers
 
 # app configuration
@@ -61,6 +62,7 @@ with st.sidebar:
                 key='page_index',
                 label='PAGE',
                 options=handlers.page_indices(),
+                format_func=handlers.page_label,
                 placeholder="Upload folder empty.",
             )
             
@@ -121,15 +123,60 @@ with st.sidebar:
                 value=450,
                 step=10,
                 on_change=handlers.on_dpi_change,
+                disabled=handlers.deep_zoom_enabled(),
                 help='Controls page rasterization and box rendering scale.',
             )
-        
+            st.checkbox(
+                key='deep_zoom',
+                label='DEEP ZOOM',
+                value=False,
+                on_change=handlers.on_dpi_change,
+                help='Show a low-resolution page and render sharp tiles for the region you box-select.',
+            )
+            st.slider(
+                key='lookahead',
+                label='LOOK-AHEAD',
+                min_value=0,
+                max_value=10,
+                value=handlers.LOOKAHEAD,
+                step=1,
+                help='Pages rendered ahead of the current page.',
+            )
+            st.selectbox(
+                key='raster_mode',
+                label='COLOR MODE',
+                options=handlers.RASTER_MODES,
+                on_change=handlers.on_dpi_change,
+                help='Render pages in gray to use a third of the memory of RGB; most inspected pages are black and white.',
+            )
+            st.selectbox(
+                key='image_format',
+                label='IMAGE FORMAT',
+                options=handlers.IMAGE_FORMATS,
+                help='Encoding of the page image sent to the browser. JPEG and WebP are smaller but lossy.',
+            )
+            st.slider(
+                key='image_quality',
+                label='IMAGE QUALITY',
+                min_value=10,
+                max_value=100,
+                value=handlers.IMAGE_QUALITY,
+                step=5,
+                help='Quality of lossy page images (JPEG, WebP).',
+            )
+            st.checkbox(
+                key='prerender',
+                label='RENDER ALL PAGES ON UPLOAD',
+                value=False,
+                help='Rasterize every page up front across the worker processes instead of on demand.',
+            )
+
         # ocr settings expander
         with st.expander(label='OCR SETTINGS', expanded=False):
             st.radio(
                 key='ocr_mode',
                 label='Mode',
-                options=['off','auto','full'],
+                options=handlers.OCR_MODES,
             )
 
         # extraction settings expander
@@ -211,23 +258,201 @@ with st.sidebar:
                 help='Attempt to segment page into different regions.',
             )
 
+        # flag comparison expander
+        with st.expander(label='COMPARE SETTINGS', expanded=False):
+            st.checkbox(
+                key='compare',
+                label='COMPARE CONFIGURATIONS',
+                value=False,
+                help='Compare the boxes of the current settings with other flag and OCR configurations.',
+            )
+
+            st.multiselect(
+                key='compare_flags',
+                label='FLIP FLAGS',
+                options=handlers.FLAG_KEYS,
+                help='Each selected flag is compared on its own, flipped from the extraction settings.',
+            )
+
+            st.multiselect(
+                key='compare_ocr',
+                label='OCR MODES',
+                options=handlers.OCR_MODES,
+                help='Each selected OCR mode is compared with the extraction settings.',
+            )
+
+            st.slider(
+                key='compare_min_iou',
+                label='MATCH IOU',
+                min_value=0.1,
+                max_value=1.0,
+                value=comparison.COMPARE_MIN_IOU,
+                step=0.05,
+                help='Minimum overlap for two boxes to count as the same box.',
+            )
+
+        # annotated pdf export expander
+        with st.expander(label='EXPORT', expanded=False):
+            st.multiselect(
+                key='export_levels',
+                label='LEVELS',
+                options=handlers.LEVELS,
+                default=handlers.EXPORT_LEVELS,
+                help='Levels whose boxes are drawn into the exported PDF.',
+            )
+
+            st.checkbox(
+                key='export_layers',
+                label='ONE LAYER PER LEVEL',
+                value=True,
+                help='Put each level in its own PDF layer that viewers can show or hide.',
+            )
+
+            st.radio(
+                key='export_scope',
+                label='EXPORT',
+                options=handlers.EXPORT_SCOPES,
+                horizontal=True,
+                label_visibility='collapsed',
+            )
+
+            st.button(
+                key='export_run',
+                label='EXPORT PDF',
+                type='tertiary',
+                disabled=not handlers.export_docs() or not handlers.current_export_levels(),
+                on_click=handlers.on_export,
+            )
+
+            export = handlers.current_export()
+            if export:
+                file_name, data, mime, failed = export
+                if failed:
+                    st.warning(f"{failed} pages failed and were exported without boxes.")
+                st.download_button(
+                    key='export_download',
+                    label=f'DOWNLOAD {file_name}',
+                    data=data,
+                    file_name=file_name,
+                    mime=mime,
+                    type='tertiary',
+                    on_click='ignore',
+                )
+
+        # instrumentation expander, filled in after the main panel has run
+        instrument_panel = st.expander(label='INSTRUMENTATION', expanded=False)
+
 # main panel
 with st.container(key='main_panel',gap=None):
     
+    if comparison.compare_enabled():
+        st.selectbox(
+            key='compare_highlight',
+            label='HIGHLIGHT',
+            options=comparison.comparison_labels(),
+            placeholder='Select flags or OCR modes to compare.',
+            help='Removed boxes are red, added green and shifted orange.',
+        )
+
     fig = handlers.current_page_figure(
         handlers.current_flags(),
         handlers.current_ocr_mode(),
         handlers.current_dpi(),
+        diff=comparison.page_diff_boxes(handlers.current_flags(), handlers.current_ocr_mode()),
     )
 
+    for message in handlers.current_page_status():
+        st.warning(f"Page {st.session_state.page_index} {message}")
+
+    if handlers.current_page_status():
+        st.button(
+            key='page_retry',
+            label='RETRY PAGE',
+            type='tertiary',
+            on_click=handlers.on_page_retry,
+        )
+
+    if fig and handlers.deep_zoom_enabled():
+        st.button(
+            key='zoom_reset',
+            label='RESET ZOOM',
+            type='tertiary',
+            disabled=handlers.current_zoom_region() is None,
+            on_click=handlers.on_zoom_reset,
+        )
+
     if fig:
-        st.plotly_chart(
-            fig,
-            width="content",
-            config={
-                "displaylogo": False,
-                "modeBarButtonsToRemove": ["pan2d", "autoScale2d"],
-                "scrollZoom": True,
-                "responsive": False,
-            },
+        with handlers.stage_span("app.plotly_chart"):
+            st.plotly_chart(
+                fig,
+                key="page_chart",
+                width="content",
+                on_select=handlers.on_page_select,
+                selection_mode=("points", "box"),
+                config={
+                    "displaylogo": False,
+                    "modeBarButtonsToRemove": ["pan2d", "autoScale2d"],
+                    "scrollZoom": True,
+                    "responsive": False,
+                },
+            )
+
+    inspection = handlers.current_inspection()
+    if inspection:
+        st.dataframe(inspection, hide_index=True)
+
+        st.button(
+            key='inspect_clear',
+            label='CLEAR SELECTION',
+            type='tertiary',
+            on_click=handlers.on_inspect_clear,
+        )
+
+    if comparison.compare_enabled():
+        st.dataframe(comparison.current_comparison_table(), hide_index=True)
+
+        st.button(
+            key='compare_document',
+            label='COMPARE DOCUMENT',
+            type='tertiary',
+            disabled=not comparison.comparison_labels(),
+            on_click=comparison.on_compare_document,
+        )
+
+        doc_rows = comparison.current_doc_comparison()
+        if doc_rows is not None:
+            st.dataframe(doc_rows, hide_index=True)
+
+
+with instrument_panel:
+    st.checkbox(
+        key='instrument',
+        label='RECORD STAGES',
+        value=handlers.instrumentation_enabled(),
+        on_change=handlers.on_instrument_change,
+        help='Time every pipeline stage and count cache hits, for all sessions of this server.',
+    )
+
+    if handlers.instrumentation_enabled():
+        st.dataframe(handlers.stage_stats(), hide_index=True)
+        st.dataframe(handlers.cache_stats(), hide_index=True)
+
+    st.dataframe(handlers.memory_stats(), hide_index=True)
+
+    with st.container(horizontal=True, horizontal_alignment="distribute", gap=None):
+        st.button(
+            key='instrument_reset',
+            label='RESET',
+            type='tertiary',
+            on_click=handlers.on_instrument_reset,
+        )
+
+        st.download_button(
+            key='instrument_trace',
+            label='DOWNLOAD TRACE',
+            data=handlers.trace_file,
+            file_name='pdf-inspector-trace.json',
+            mime='application/json',
+            type='tertiary',
+            on_click='ignore',
         )
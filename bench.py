@@ -0,0 +1,606 @@
+from typing import Callable
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pymupdf
+from PIL import Image
+
+import cli
+import core
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+DPI = 150  # page raster resolution for the render stages
+
+REPEAT = 3  # timed runs per stage; the median is reported
+
+# Regressions compare the fastest run, which is the least noisy.
+TIME_TOLERANCE = 0.25  # slowdown vs baseline reported as a regression
+TIME_FLOOR_MS = 5.0  # ignore time changes smaller than this
+
+# Only tracemalloc peaks are compared: RSS growth depends on how much
+# freed memory the allocator still holds, so it is reported for reference.
+MEMORY_TOLERANCE = 0.25
+MEMORY_FLOOR_MB = 2.0
+
+WORDS = ["alpha", "beta", "gamma-", "delta", "office", "fluffy", "fi", "x", "y", "1984"]
+
+FONTS = ["helv", "tiro", "cour", "hebo"]
+
+DENSITIES = {
+    # fontsize, words per row, rows per page
+    "sparse": (10, 12, 25),
+    "dense": (5, 28, 110),
+}
+
+# name: (generator, pages, options)
+CASES = {
+    "text-sparse": ("text", 20, {"density": "sparse"}),
+    "text-dense": ("text", 5, {"density": "dense"}),
+    "image-only": ("image", 10, {}),
+    "vector-heavy": ("vector", 5, {"paths": 5000}),
+    "long-doc": ("text", 200, {"density": "sparse"}),
+}
+
+# Fresh-process startup profiles. The app process imports handlers, then
+# extracts, renders and builds and serializes the page figure. A worker is
+# started the way the app starts one, from a process whose __main__ is
+# app.py as under `streamlit run`, and times its first extract and render.
+STARTUP_TARGETS = {
+    "app": "import handlers",
+    "worker": "spawn a worker under streamlit run",
+}
+
+STARTUP_TOP = 12  # packages listed per startup profile
+
+# init_docs times the whole document; the other stages loop over its pages.
+STAGES = [
+    "init_docs",
+    "get_textpage",
+    "extract_rects",
+    "render_pixels",
+    "encode_image",
+    "render_page_plotly",  # figure build and JSON serialization
+]
+
+
+def make_text_pdf(pages: int, *, density: str, seed: int = 0) -> bytes:
+    """
+    Pages of text rows in mixed base-14 fonts.
+    """
+    rng = random.Random(seed)
+    fontsize, per_row, rows = DENSITIES[density]
+    doc = pymupdf.open()
+
+    for _ in range(pages):
+        page = doc.new_page()
+        for row in range(rows):
+            text = " ".join(rng.choice(WORDS) for _ in range(per_row))
+            page.insert_text(
+                (20, 30 + row * fontsize * 1.4),
+                text,
+                fontsize=fontsize,
+                fontname=rng.choice(FONTS),
+            )
+
+    data = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return data
+
+
+def make_image_pdf(pages: int, *, seed: int = 0) -> bytes:
+    """
+    Pages that are a single scanned-looking JPEG each, with no text layer.
+    """
+    rng = np.random.default_rng(seed)
+    doc = pymupdf.open()
+
+    for _ in range(pages):
+        page = doc.new_page()
+        gray = rng.normal(235, 12, (1100, 850)).clip(0, 255).astype(np.uint8)
+        for _ in range(40):
+            y, x = rng.integers(50, 1050), rng.integers(50, 500)
+            gray[y:y + 12, x:x + rng.integers(100, 300)] = 30
+        buf = io.BytesIO()
+        Image.fromarray(gray).save(buf, format="JPEG", quality=75)
+        page.insert_image(page.rect, stream=buf.getvalue())
+
+    data = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return data
+
+
+def make_vector_pdf(pages: int, *, paths: int, seed: int = 0) -> bytes:
+    """
+    Pages of many stroked lines, rectangles and curves, plus a text header.
+    """
+    rng = random.Random(seed)
+    doc = pymupdf.open()
+
+    for page_index in range(pages):
+        page = doc.new_page()
+        shape = page.new_shape()
+        w, h = page.rect.width, page.rect.height
+
+        for i in range(paths):
+            p1 = pymupdf.Point(rng.uniform(0, w), rng.uniform(0, h))
+            p2 = p1 + (rng.uniform(-40, 40), rng.uniform(-40, 40))
+            kind = i % 3
+            if kind == 0:
+                shape.draw_line(p1, p2)
+            elif kind == 1:
+                shape.draw_rect(pymupdf.Rect(p1, p1 + (abs(p2.x - p1.x), abs(p2.y - p1.y))))
+            else:
+                shape.draw_bezier(p1, p1 + (10, -20), p2 + (-10, 20), p2)
+            shape.finish(color=(rng.random(), rng.random(), rng.random()), width=0.5)
+
+        shape.commit()
+        page.insert_text((20, 20), f"Vector page {page_index}", fontsize=12)
+
+    data = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return data
+
+
+GENERATORS = {
+    "text": make_text_pdf,
+    "image": make_image_pdf,
+    "vector": make_vector_pdf,
+}
+
+
+def make_case(name: str, *, quick: bool = False) -> bytes:
+    kind, pages, options = CASES[name]
+    if quick:
+        pages = max(1, pages // 5)
+    return GENERATORS[kind](pages, **options)
+
+
+class _Upload:
+    def __init__(self, name: str, data: bytes):
+        self.name = name
+        self._data = data
+
+    def getvalue(self) -> bytes:
+        return self._data
+
+
+def stage_functions(name: str, data: bytes) -> dict[str, Callable[[], object]]:
+    """
+    A zero-argument callable per stage. Each stage's inputs are produced
+    once here, outside the timed calls.
+    """
+    flags = cli.parse_flag_spec(None)
+    pdf = core.open_document(data)
+    pages = range(pdf.page_count)
+
+    textpages = [core.get_textpage(pdf, i, flags, "off") for i in pages]
+    rects = [core.extract_rects(tp) for tp in textpages]
+    images = [core.image_from_pixels(core.render_pixels(pdf, i, DPI)) for i in pages]
+    sources = [core.encode_image(image) for image in images]
+
+    def plotly_pages():
+        return [
+            core.render_page_plotly(
+                image, r["words"]["bbox"], DPI, level="words", source=source,
+            ).to_json()
+            for image, r, source in zip(images, rects, sources)
+        ]
+
+    return {
+        "init_docs": lambda: core.init_docs([_Upload(name, data)]),
+        "get_textpage": lambda: [core.get_textpage(pdf, i, flags, "off") for i in pages],
+        "extract_rects": lambda: [core.extract_rects(tp) for tp in textpages],
+        "render_pixels": lambda: [core.render_pixels(pdf, i, DPI) for i in pages],
+        "encode_image": lambda: [core.encode_image(image) for image in images],
+        "render_page_plotly": plotly_pages,
+    }
+
+
+def _status_kb(field: str) -> int | None:
+    try:
+        with open("/proc/self/status") as f:
+            match = re.search(rf"^{field}:\s+(\d+) kB", f.read(), re.MULTILINE)
+    except OSError:
+        return None
+    return int(match.group(1)) if match else None
+
+
+def _reset_peak_rss() -> bool:
+    # Linux only: writing 5 to clear_refs resets VmHWM to the current RSS.
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def measure(fn: Callable[[], object], repeat: int) -> dict:
+    """
+    Median and minimum wall time over repeat runs, then one untimed run
+    for peak memory: Python/NumPy allocations via tracemalloc, and peak
+    process RSS growth (which includes MuPDF and Pillow) where Linux lets
+    it be reset.
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+
+    gc.collect()
+    rss_before = _status_kb("VmRSS")
+    can_reset = rss_before is not None and _reset_peak_rss()
+    tracemalloc.start()
+    result = fn()
+    py_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    rss_peak = _status_kb("VmHWM") if can_reset else None
+    del result
+
+    return {
+        "ms": round(statistics.median(times), 3),
+        "min_ms": round(min(times), 3),
+        "py_peak_mb": round(py_peak / 2**20, 3),
+        "rss_peak_mb": round((rss_peak - rss_before) / 1024, 3) if rss_peak is not None else None,
+    }
+
+
+def run(cases: list[str], stages: list[str], *, quick: bool, repeat: int) -> dict:
+    results: dict = {}
+    for name in cases:
+        data = make_case(name, quick=quick)
+        fns = stage_functions(name, data)
+        with core.open_document(data) as pdf:
+            page_count = pdf.page_count
+
+        results[name] = {}
+        for stage in stages:
+            result = measure(fns[stage], repeat)
+            result["pages"] = page_count
+            results[name][stage] = result
+            print(f"  {name:<14} {stage:<20} {result['ms']:>10.1f} ms", file=sys.stderr)
+
+    return {
+        "meta": {
+            "quick": quick,
+            "dpi": DPI,
+            "python": platform.python_version(),
+            "pymupdf": pymupdf.VersionBind,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+
+
+def _first(times: dict[str, float], stage: str, fn: Callable[[], object]):
+    start = time.perf_counter()
+    result = fn()
+    times[stage] = round((time.perf_counter() - start) * 1000, 3)
+    return result
+
+
+def _first_calls() -> dict[str, float]:
+    """
+    Time the first call of each stage a fresh app process makes on a
+    one-page document, after handlers was imported.
+    """
+    data = make_text_pdf(1, density="sparse")
+    times: dict[str, float] = {}
+
+    flags = cli.parse_flag_spec(None)
+    pdf = _first(times, "open_document", lambda: core.open_document(data))
+    rects = _first(
+        times, "extract_rects",
+        lambda: core.extract_rects(core.get_textpage(pdf, 0, flags, "off")),
+    )
+    pixels = _first(times, "render_pixels", lambda: core.render_pixels(pdf, 0, DPI))
+    image = core.image_from_pixels(pixels)
+    source = _first(times, "encode_image", lambda: core.encode_image(image))
+    _first(
+        times, "render_page_plotly",
+        lambda: core.render_page_plotly(
+            image, rects["words"]["bbox"], DPI, level="words", source=source,
+        ).to_json(),
+    )
+    return times
+
+
+def _worker_calls() -> dict[str, float]:
+    """
+    Time the first extract of a new worker pool, which starts the worker
+    process, and its first render.
+    """
+    import workers
+
+    data = make_text_pdf(1, density="sparse")
+    doc = {"hash": core.content_hash(data), "bytes": data}
+    pool = workers.WorkerPool(1)
+    times: dict[str, float] = {}
+
+    flags = cli.parse_flag_spec(None)
+    _first(times, "start_and_extract", lambda: pool.extract(doc, 0, flags, "off"))
+    _first(times, "render", lambda: pool.render(doc, 0, DPI))
+    return times
+
+
+# Run with python -X importtime -c in a fresh interpreter: handlers is
+# imported before bench and its dependencies, then the first calls are timed.
+STARTUP_APP_CHILD = """
+import time
+start = time.perf_counter()
+import handlers
+import_ms = (time.perf_counter() - start) * 1000
+import bench, json
+print(json.dumps({"import_ms": import_ms, "first_ms": bench._first_calls()}))
+"""
+
+# Run with python -c: installs the __main__ `streamlit run` leaves (the app
+# script, with no spec) before starting a worker, and turns on
+# -X importtime for the worker process only.
+STARTUP_WORKER_CHILD = """
+import json, os, sys, types
+main = types.ModuleType("__main__")
+main.__file__ = {app!r}
+main.__spec__ = None
+sys.modules["__main__"] = main
+os.environ["PYTHONPROFILEIMPORTTIME"] = "1"
+import bench
+print(json.dumps({{"first_ms": bench._worker_calls()}}))
+"""
+
+
+def _import_times(stderr: str, module: str) -> tuple[float, dict[str, float]]:
+    """
+    From python -X importtime output, the cumulative milliseconds of the
+    top-level import of module, and the milliseconds per top-level package,
+    summing each module's own (self) time up to that import. Interpreter
+    startup (site, encodings) is included.
+    """
+    total = 0.0
+    totals: dict[str, float] = {}
+    for line in stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)", line)
+        if match is None:
+            continue
+        name = match.group(4)
+        package = name.split(".")[0]
+        totals[package] = totals.get(package, 0.0) + int(match.group(1)) / 1000
+        if name == module and not match.group(3):
+            total = int(match.group(2)) / 1000
+            break
+    packages = {k: round(v, 3) for k, v in sorted(totals.items(), key=lambda kv: -kv[1])}
+    return round(total, 3), packages
+
+
+def _startup_run(target: str) -> dict:
+    here = os.path.dirname(os.path.abspath(__file__))
+    if target == "app":
+        args = [sys.executable, "-X", "importtime", "-c", STARTUP_APP_CHILD]
+        module = "handlers"
+    else:
+        app = os.path.join(here, "app.py")
+        args = [sys.executable, "-c", STARTUP_WORKER_CHILD.format(app=app)]
+        module = "workers"
+
+    proc = subprocess.run(args, capture_output=True, text=True, check=True, cwd=here)
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    import_ms, result["modules"] = _import_times(proc.stderr, module)
+
+    if target == "app":
+        result["total_ms"] = result["import_ms"] + sum(result["first_ms"].values())
+    else:
+        # The worker imports inside its first call, which is already timed.
+        result["import_ms"] = import_ms
+        result["total_ms"] = sum(result["first_ms"].values())
+    return result
+
+
+def startup_profile(target: str, repeat: int) -> dict:
+    """
+    Import and first-call times of target in fresh processes, keeping the
+    fastest of repeat runs, with the import time split by top-level
+    package.
+    """
+    runs = [_startup_run(target) for _ in range(repeat)]
+    best = min(runs, key=lambda r: r["total_ms"])
+    return {
+        "import_ms": round(best["import_ms"], 3),
+        "min_ms": round(best["total_ms"], 3),
+        "first_ms": {
+            stage: min(r["first_ms"][stage] for r in runs)
+            for stage in best["first_ms"]
+        },
+        "modules": dict(list(best["modules"].items())[:STARTUP_TOP]),
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Regressions of report against baseline: stages whose fastest run is
+    slower, or whose Python/NumPy peak memory is higher, than tolerance
+    allows, and startup profiles whose fastest import plus first calls is
+    slower, ignoring changes below the floors.
+    """
+    regressions = []
+    for name, stages in report["results"].items():
+        for stage, result in stages.items():
+            base = baseline["results"].get(name, {}).get(stage)
+            if base is None:
+                continue
+
+            if result["min_ms"] - base["min_ms"] > max(TIME_FLOOR_MS, base["min_ms"] * tolerance):
+                regressions.append(
+                    f"{name} {stage}: {result['min_ms']:.1f} ms vs {base['min_ms']:.1f} ms"
+                )
+
+            grown = result["py_peak_mb"] - base["py_peak_mb"]
+            if grown > max(MEMORY_FLOOR_MB, base["py_peak_mb"] * MEMORY_TOLERANCE):
+                regressions.append(
+                    f"{name} {stage}: {result['py_peak_mb']:.1f} MB vs {base['py_peak_mb']:.1f} MB"
+                )
+
+    for target, result in report.get("startup", {}).items():
+        base = baseline.get("startup", {}).get(target)
+        if base is None:
+            continue
+        if result["min_ms"] - base["min_ms"] > max(TIME_FLOOR_MS, base["min_ms"] * tolerance):
+            regressions.append(
+                f"startup {target}: {result['min_ms']:.1f} ms vs {base['min_ms']:.1f} ms"
+            )
+
+    return regressions
+
+
+def format_startup(report: dict, baseline: dict | None) -> str:
+    lines = []
+    for target, r in report["startup"].items():
+        base = (baseline or {}).get("startup", {}).get(target)
+        title = (
+            f"startup {target} ({STARTUP_TARGETS[target]}): "
+            f"{r['min_ms']:.1f} ms, import {r['import_ms']:.1f} ms"
+        )
+        if base:
+            change = (r["min_ms"] / base["min_ms"] - 1) * 100 if base["min_ms"] else 0.0
+            title += f", base {base['min_ms']:.1f} ms ({change:+.0f}%)"
+        lines += ["", title, "-" * len(title)]
+
+        lines.append("  first calls:")
+        for stage, ms in r["first_ms"].items():
+            lines.append(f"    {stage:<22} {ms:>9.1f} ms")
+        lines.append("  import by package (self time, -X importtime):")
+        for package, ms in r["modules"].items():
+            lines.append(f"    {package:<22} {ms:>9.1f} ms")
+
+    return "\n".join(lines)
+
+
+def format_report(report: dict, baseline: dict | None) -> str:
+    header = (
+        f"{'case':<14} {'stage':<20} {'ms':>10} {'min ms':>10} {'ms/page':>9} "
+        f"{'py MB':>8} {'rss MB':>8}"
+    )
+    if baseline:
+        header += f" {'base min':>10} {'change':>8}"
+    lines = [header, "-" * len(header)]
+
+    for name, stages in report["results"].items():
+        for stage, r in stages.items():
+            per_page = r["ms"] / max(r["pages"], 1)
+            rss = f"{r['rss_peak_mb']:.1f}" if r["rss_peak_mb"] is not None else "-"
+            line = (
+                f"{name:<14} {stage:<20} {r['ms']:>10.1f} {r['min_ms']:>10.1f} "
+                f"{per_page:>9.2f} {r['py_peak_mb']:>8.1f} {rss:>8}"
+            )
+
+            base = (baseline or {}).get("results", {}).get(name, {}).get(stage)
+            if base:
+                change = (r["min_ms"] / base["min_ms"] - 1) * 100 if base["min_ms"] else 0.0
+                line += f" {base['min_ms']:>10.1f} {change:>+7.0f}%"
+            lines.append(line)
+
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the PDF pipeline stages on synthetic PDFs.",
+    )
+    parser.add_argument(
+        "--cases", default=",".join(CASES),
+        help=f"Comma list of cases (default: all of {', '.join(CASES)}).",
+    )
+    parser.add_argument(
+        "--stages", default=",".join(STAGES),
+        help=f"Comma list of stages (default: all of {', '.join(STAGES)}).",
+    )
+    parser.add_argument("--quick", action="store_true", help="Use a fifth of the pages per case.")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument(
+        "--baseline", default=BASELINE_PATH,
+        help="Baseline JSON to compare against, if it exists.",
+    )
+    parser.add_argument(
+        "--save-baseline", action="store_true",
+        help="Write the results to the baseline file instead of comparing.",
+    )
+    parser.add_argument("--tolerance", type=float, default=TIME_TOLERANCE)
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    parser.add_argument(
+        "--startup", action="store_true",
+        help="Also profile cold start: imports and first calls of a fresh app process and worker.",
+    )
+    args = parser.parse_args(argv)
+
+    cases = [c for c in args.cases.split(",") if c]
+    stages = [s for s in args.stages.split(",") if s]
+    for value, known in [(cases, CASES), (stages, STAGES)]:
+        unknown = [v for v in value if v not in known]
+        if unknown:
+            parser.error(f"Unknown: {', '.join(unknown)}")
+
+    report = run(cases, stages, quick=args.quick, repeat=max(1, args.repeat))
+    if args.startup:
+        report["startup"] = {
+            target: startup_profile(target, max(1, args.repeat))
+            for target in STARTUP_TARGETS
+        }
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        if report["results"]:
+            print(format_report(report, None))
+        if "startup" in report:
+            print(format_startup(report, None))
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("quick") != args.quick:
+            print("Baseline was recorded with a different --quick setting; not comparing.")
+            baseline = None
+
+    if report["results"]:
+        print(format_report(report, baseline))
+    if "startup" in report:
+        print(format_startup(report, baseline))
+
+    if baseline is None:
+        return 0
+
+    regressions = compare(report, baseline, args.tolerance)
+    if regressions:
+        print("\nRegressions:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+
+    print("\nNo regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,326 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+import logging
+import os
+import queue
+import tempfile
+import threading
+
+import instrument
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get(
+    "PDF_INSPECTOR_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "pdf-inspector"),
+)
+
+RASTER_CACHE_MB = int(os.environ.get("PDF_INSPECTOR_RASTER_CACHE_MB", "2048"))
+
+PAGE_CACHE_MB = int(os.environ.get("PDF_INSPECTOR_PAGE_CACHE_MB", "512"))
+
+BOX_CACHE_MB = int(os.environ.get("PDF_INSPECTOR_BOX_CACHE_MB", "256"))
+
+TILE_CACHE_MB = int(os.environ.get("PDF_INSPECTOR_TILE_CACHE_MB", "128"))
+
+OCR_CACHE_MB = int(os.environ.get("PDF_INSPECTOR_OCR_CACHE_MB", "512"))
+
+INDEX_CACHE_MB = int(os.environ.get("PDF_INSPECTOR_INDEX_CACHE_MB", "64"))
+
+WRITE_QUEUE = 4  # pending background writes per disk cache before put_later blocks
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory mapping bounded by an estimated byte size.
+
+    - sizeof(value) estimates the memory held by each entry.
+    - Inserting past max_bytes evicts least recently used entries.
+    - Lookups are counted as hits and misses under name when
+      instrumentation is enabled.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        sizeof: Callable[[Any], int],
+        *,
+        name: str | None = None,
+    ):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.name = name
+        self.nbytes = 0
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._inflight: dict[Hashable, list] = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if self.name:
+            instrument.cache_access(self.name, entry is not None)
+        return entry[0] if entry is not None else None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        size = self.sizeof(value)
+
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (value, size)
+            self.nbytes += size
+
+            while self.nbytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.nbytes -= evicted
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Return the value for key, computing and storing it on a miss.
+
+        Concurrent callers for the same key wait for one computation and
+        share its result or re-raise its exception.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            else:
+                flight = self._inflight.get(key)
+                owner = flight is None
+                if owner:
+                    flight = self._inflight[key] = [threading.Event(), None, None]
+
+        if self.name:
+            instrument.cache_access(self.name, entry is not None)
+        if entry is not None:
+            return entry[0]
+
+        if not owner:
+            flight[0].wait()
+            if flight[2] is not None:
+                raise flight[2]
+            return flight[1]
+
+        try:
+            flight[1] = compute()
+            self.put(key, flight[1])
+            return flight[1]
+        except BaseException as exc:
+            flight[2] = exc
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight[0].set()
+
+    def pop(self, key: Hashable) -> Any | None:
+        with self._lock:
+            return self._pop(key)
+
+    def _pop(self, key: Hashable) -> Any | None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+
+        self.nbytes -= entry[1]
+        return entry[0]
+
+    def remove_if(self, predicate: Callable[[Hashable], bool]) -> None:
+        """
+        Drop every entry whose key matches predicate.
+        """
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                self._pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+class DiskCache:
+    """
+    Size-bounded on-disk byte cache with least-recently-used eviction.
+
+    - Entries are files named by key, written atomically.
+    - Reads refresh the file mtime, which serves as the LRU clock.
+    - A max_bytes of 0 disables the cache.
+    - Reads are counted as hits and misses under name when
+      instrumentation is enabled.
+    - put_later encodes and writes an entry on a background thread.
+    """
+
+    def __init__(self, root: str, max_bytes: int, *, name: str | None = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.name = name
+        self._size: int | None = None
+        self._lock = threading.RLock()  # guards _size and replacing entries
+        self._writes: queue.Queue | None = None
+        self._writer_lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key: str) -> bytes | None:
+        if self.max_bytes <= 0:
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            data = None
+
+        if self.name:
+            instrument.cache_access(self.name, data is not None)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if self.max_bytes <= 0 or len(data) > self.max_bytes:
+            return
+
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+
+            with self._lock:
+                size = self.size()
+                try:
+                    size -= os.stat(path).st_size
+                except OSError:
+                    pass
+                os.replace(tmp, path)
+                self._size = size + len(data)
+                if self._size > self.max_bytes:
+                    self._evict()
+        except OSError:
+            return
+
+    def put_later(self, key: str, encode: Callable[[], bytes]) -> None:
+        """
+        Store encode() under key from the writer thread, off the caller's path.
+
+        Blocks while WRITE_QUEUE writes are pending, so the values held for
+        encoding stay bounded. Writes still pending at exit are lost.
+        """
+        if self.max_bytes <= 0:
+            return
+
+        with self._writer_lock:
+            if self._writes is None:
+                self._writes = queue.Queue(maxsize=WRITE_QUEUE)
+                threading.Thread(
+                    target=self._write_loop,
+                    name=f"disk-cache-{os.path.basename(self.root)}",
+                    daemon=True,
+                ).start()
+
+        self._writes.put((key, encode))
+
+    def _write_loop(self) -> None:
+        while True:
+            key, encode = self._writes.get()
+            try:
+                self.put(key, encode())
+            except Exception:
+                logger.exception("Disk cache write of %r failed", key)
+            finally:
+                self._writes.task_done()
+
+    def size(self) -> int:
+        with self._lock:
+            if self._size is None:
+                self._size = sum(st.st_size for _, st in self._entries())
+            return self._size
+
+    def _entries(self) -> list[tuple[str, os.stat_result]]:
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".tmp"):
+                    continue  # being written
+                try:
+                    entries.append((entry.path, entry.stat()))
+                except OSError:
+                    continue
+
+        return entries
+
+    def _evict(self) -> None:
+        """
+        Delete least recently used entries until the cache is at 90% of budget.
+        """
+        entries = sorted(self._entries(), key=lambda e: e[1].st_mtime)
+        size = sum(st.st_size for _, st in entries)
+        target = int(self.max_bytes * 0.9)
+
+        for path, st in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= st.st_size
+
+        self._size = size
+
+
+class DeferredWrites:
+    """
+    Read-through view of a DiskCache that collects writes instead of
+    making them.
+
+    Worker processes use it so that their writes are made by the pool's
+    process, which then is the only one keeping the cache within its
+    budget.
+    """
+
+    def __init__(self, cache: DiskCache):
+        self.cache = cache
+        self.writes: list[tuple[str, bytes]] = []
+
+    def get(self, key: str) -> bytes | None:
+        return self.cache.get(key)
+
+    def put(self, key: str, data: bytes) -> None:
+        self.writes.append((key, data))
+
+    def take(self) -> list[tuple[str, bytes]]:
+        writes, self.writes = self.writes, []
+        return writes
+
+
+RASTER_CACHE = DiskCache(
+    os.path.join(CACHE_DIR, "rasters"),
+    RASTER_CACHE_MB * 1024 * 1024,
+    name="rasters (disk)",
+)
+
+OCR_CACHE = DiskCache(
+    os.path.join(CACHE_DIR, "ocr"),
+    OCR_CACHE_MB * 1024 * 1024,
+    name="ocr (disk)",
+)
@@ -0,0 +1,633 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, Iterator
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+import core
+import workers
+
+LEVEL_COLUMNS = {
+    "blocks": ["bbox"],
+    "lines": ["bbox", "block"],
+    "spans": ["bbox", "line", "block", "text", "font", "size", "flags"],
+    "words": ["bbox", "line", "block", "text"],
+    "chars": ["bbox", "span", "codepoint", "origin"],  # only with --chars
+}
+
+# Fixed-size list widths of the array columns with more than one value per row.
+COLUMN_WIDTHS = {"bbox": 4, "origin": 2}
+
+# Matches the extraction settings defaults in app.py.
+DEFAULT_FLAGS = {
+    "text_preserve_ligatures",
+    "text_preserve_whitespace",
+    "text_preserve_images",
+    "text_mediabox_clip",
+    "text_use_cid_for_unknown_unicode",
+}
+
+ROW_GROUP_PAGES = 64  # pages buffered per Parquet row group
+
+
+def parse_flag_spec(spec: str | None) -> int:
+    """
+    Resolve a command-line flag spec into a PyMuPDF flag integer.
+
+    - None or "default": the app's default extraction settings.
+    - An integer: used as is.
+    - A comma list of FLAG_MAP keys, with or without the "text_" prefix,
+      in any case (e.g. "preserve_images" or "TEXT_PRESERVE_IMAGES").
+      When every item starts with "+" or "-", the items enable or disable
+      flags on top of the defaults; otherwise the list is the exact set of
+      enabled flags ("none" for no flags).
+    """
+    if spec is None or spec.strip() == "default":
+        return core.resolve_text_flags(dict.fromkeys(DEFAULT_FLAGS, True))
+
+    spec = spec.strip()
+    if spec.lstrip("-").isdigit():
+        return int(spec)
+
+    items = [item.strip() for item in spec.split(",") if item.strip()]
+    relative = all(item[0] in "+-" for item in items)
+    state = dict.fromkeys(DEFAULT_FLAGS if relative else (), True)
+
+    for item in items:
+        if item == "none":
+            continue
+
+        enabled = not item.startswith("-")
+        name = item.lstrip("+-").lower()
+        key = name if name in core.FLAG_MAP else f"text_{name}"
+        if key not in core.FLAG_MAP:
+            raise ValueError(f"Invalid flag: {name}")
+        state[key] = enabled
+
+    return core.resolve_text_flags(state)
+
+
+def find_pdfs(paths: Iterable[str]) -> Iterator[str]:
+    """
+    Yield PDF file paths, walking directories recursively in name order.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(".pdf"):
+                    yield os.path.join(root, name)
+
+
+def file_stamp(path: str) -> tuple[int, int] | None:
+    """
+    The size and modification time (ns) of a file, which identify the
+    version of a document a record was extracted from; None if missing.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def record_stamp(record: dict) -> tuple[int, int] | None:
+    if record.get("file_size") is None:
+        return None
+    return record["file_size"], record["file_mtime_ns"]
+
+
+def rects_to_record(rects: dict) -> dict:
+    """
+    Convert extract_rects output into JSON-serializable columns.
+    """
+    record = {}
+    for level in LEVEL_COLUMNS:
+        if level not in rects:
+            continue
+        record[level] = {
+            col: np.round(arr.astype(np.float64), 3).tolist() if arr.dtype.kind == "f" else arr.tolist()
+            for col, arr in rects[level].items()
+        }
+    return record
+
+
+class JsonlSink:
+    """
+    Write one JSON line per page to a single file.
+
+    On resume, a line cut short by an interruption is truncated and pages
+    with a record are skipped. Records of pages that failed, or of files
+    that changed since (by size and modification time), are removed first,
+    so those pages are extracted again and their new records replace them.
+    """
+
+    def __init__(self, path: str, *, resume: bool = False):
+        self.path = path
+        self.done: dict[str, set] = {}
+
+        if resume and os.path.exists(path):
+            self._scan()
+            self.file = open(path, "a", encoding="utf-8")
+        else:
+            self.file = open(path, "w", encoding="utf-8")
+
+    def _scan(self) -> None:
+        stamps: dict[str, tuple[int, int] | None] = {}
+        stale = 0
+        with open(self.path, "rb+") as f:
+            offset = 0
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError
+                    record = json.loads(line)
+                except ValueError:
+                    f.truncate(offset)
+                    break
+                offset += len(line)
+
+                if self._is_done(record, stamps):
+                    self.done.setdefault(record["path"], set()).add(record["page"])
+                else:
+                    stale += 1
+
+        if stale:
+            self._drop_stale(stamps)
+
+    @staticmethod
+    def _is_done(record: dict, stamps: dict[str, tuple[int, int] | None]) -> bool:
+        path = record["path"]
+        if path not in stamps:
+            stamps[path] = file_stamp(path)
+        return "error" not in record and record_stamp(record) == stamps[path]
+
+    def _drop_stale(self, stamps: dict[str, tuple[int, int] | None]) -> None:
+        """
+        Rewrite the file with only the records counted as done.
+        """
+        tmp = self.path + ".tmp"
+        with open(self.path, "rb") as src, open(tmp, "wb") as dst:
+            for line in src:
+                if self._is_done(json.loads(line), stamps):
+                    dst.write(line)
+        os.replace(tmp, self.path)
+
+    def pending_pages(self, path: str, page_count: int, stamp: tuple[int, int] | None) -> list[int]:
+        done = self.done.get(path, set())
+        return [i for i in range(page_count) if i not in done]
+
+    def write(self, record: dict, rects: dict | None) -> None:
+        if rects is not None:
+            record.update(rects_to_record(rects))
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def end_document(self, path: str) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ParquetSink:
+    """
+    Write one Parquet file per document into an output directory.
+
+    - Pages are buffered ROW_GROUP_PAGES at a time, never a whole document.
+    - Files are named by a hash of the document path, written under a
+      temporary name and renamed when the document is complete, so on
+      resume finished documents are skipped and partial ones are redone.
+      Documents with failed pages, or that changed since (by the
+      file_size and file_mtime_ns columns), are redone as well.
+    - The chars level columns are written only when chars is set.
+
+    Requires pyarrow.
+    """
+
+    def __init__(self, path: str, *, resume: bool = False, chars: bool = False):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet output requires pyarrow: pip install pyarrow")
+
+        self.pa = pa
+        self.pq = pq
+        self.root = path
+        self.resume = resume
+        self.levels = [level for level in LEVEL_COLUMNS if chars or level != "chars"]
+        self.writer = None
+        self.rows: list[tuple[dict, dict | None]] = []
+
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.endswith(".parquet.tmp"):
+                os.remove(os.path.join(path, name))
+
+    def _part(self, path: str) -> str:
+        name = hashlib.sha1(path.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, f"{name}.parquet")
+
+    def pending_pages(self, path: str, page_count: int, stamp: tuple[int, int] | None) -> list[int]:
+        if self.resume and os.path.exists(self._part(path)) and self._complete(path, stamp):
+            return []
+        return list(range(page_count))
+
+    def _complete(self, path: str, stamp: tuple[int, int] | None) -> bool:
+        table = self.pq.read_table(
+            self._part(path), columns=["file_size", "file_mtime_ns", "error"],
+        )
+        if table.column("error").null_count != table.num_rows:
+            return False
+        stamps = {
+            (size, mtime)
+            for size, mtime in zip(
+                table.column("file_size").to_pylist(),
+                table.column("file_mtime_ns").to_pylist(),
+            )
+        }
+        return stamps == {stamp}
+
+    def write(self, record: dict, rects: dict | None) -> None:
+        self.rows.append((record, rects))
+        if len(self.rows) >= ROW_GROUP_PAGES:
+            self._flush(record["path"])
+
+    def _flush(self, path: str) -> None:
+        if not self.rows:
+            return
+
+        table = self._table(self.rows)
+        self.rows = []
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self._part(path) + ".tmp", table.schema)
+        self.writer.write_table(table)
+
+    def _table(self, rows: list[tuple[dict, dict | None]]):
+        pa = self.pa
+        columns = {
+            key: pa.array([record.get(key) for record, _ in rows], type=type_)
+            for key, type_ in [
+                ("path", pa.string()),
+                ("page", pa.int32()),
+                ("flags", pa.int64()),
+                ("ocr", pa.string()),
+                ("file_size", pa.int64()),
+                ("file_mtime_ns", pa.int64()),
+                ("error", pa.string()),
+            ]
+        }
+
+        for level in self.levels:
+            for col in LEVEL_COLUMNS[level]:
+                arrays = [
+                    rects[level][col] if rects is not None else _empty_column(col)
+                    for _, rects in rows
+                ]
+                lengths = [len(a) for a in arrays]
+                offsets = pa.array(np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32))
+                values = pa.array(np.concatenate(arrays).reshape(-1))
+                if col in COLUMN_WIDTHS:
+                    values = pa.FixedSizeListArray.from_arrays(values, COLUMN_WIDTHS[col])
+                columns[f"{level}_{col}"] = pa.ListArray.from_arrays(offsets, values)
+
+        return pa.table(columns)
+
+    def end_document(self, path: str) -> None:
+        self._flush(path)
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            os.replace(self._part(path) + ".tmp", self._part(path))
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+
+class AnnotateSink:
+    """
+    Write a copy of each document with its boxes drawn on the pages into
+    an output directory, mirroring the input layout.
+
+    - Pages are drawn as their rects arrive; only the open output document
+      is held, never the rects of a whole document.
+    - Files are written under a temporary name and renamed when the
+      document is complete, so on resume finished documents are skipped
+      unless the input is newer than the output.
+    - Pages that failed to extract are copied without boxes and listed in
+      a "<output>.failed" file next to it; on resume those documents are
+      redone.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        inputs: Iterable[str],
+        levels: list[str],
+        *,
+        layers: bool = True,
+        resume: bool = False,
+    ):
+        self.root = path
+        self.inputs = [os.path.abspath(p) for p in inputs if os.path.isdir(p)]
+        self.levels = levels
+        self.layers = layers
+        self.resume = resume
+        self.pdf = None
+        self.groups: dict[str, int] | None = None
+        self.failed: list[int] = []
+
+        os.makedirs(path, exist_ok=True)
+
+    def _part(self, path: str) -> str:
+        source = os.path.abspath(path)
+        name = os.path.basename(source)
+        for root in self.inputs:
+            if source.startswith(root + os.sep):
+                name = os.path.relpath(source, root)
+                break
+
+        out = os.path.join(self.root, name)
+        if os.path.abspath(out) == source:
+            raise SystemExit(f"Output would overwrite the input: {path}")
+        return out
+
+    def pending_pages(self, path: str, page_count: int, stamp: tuple[int, int] | None) -> list[int]:
+        out = self._part(path)
+        if (
+            self.resume
+            and stamp is not None
+            and not os.path.exists(out + ".failed")
+            and file_stamp(out) is not None
+            and file_stamp(out)[1] >= stamp[1]
+        ):
+            return []
+        return list(range(page_count))
+
+    def write(self, record: dict, rects: dict | None) -> None:
+        if record["page"] is None:
+            return
+        if "error" in record:
+            self.failed.append(record["page"])
+
+        if self.pdf is None:
+            self.pdf = core.open_document(record["path"])
+            self.groups = core.add_level_layers(self.pdf, self.levels) if self.layers else None
+        if rects is not None:
+            core.annotate_page(self.pdf[record["page"]], rects, self.levels, layers=self.groups)
+
+    def end_document(self, path: str) -> None:
+        if self.pdf is None:
+            return
+
+        out = self._part(path)
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+        self.pdf.save(out + ".tmp", garbage=1, deflate=True)
+        self.pdf.close()
+        self.pdf = None
+        os.replace(out + ".tmp", out)
+
+        if self.failed:
+            with open(out + ".failed", "w", encoding="utf-8") as f:
+                f.writelines(f"{page}\n" for page in self.failed)
+            self.failed = []
+        elif os.path.exists(out + ".failed"):
+            os.remove(out + ".failed")
+
+    def close(self) -> None:
+        if self.pdf is not None:
+            self.pdf.close()
+
+
+def _empty_column(col: str) -> np.ndarray:
+    if col in COLUMN_WIDTHS:
+        return np.zeros((0, COLUMN_WIDTHS[col]), dtype=np.float32)
+    if col in ("text", "font"):
+        return np.zeros(0, dtype=np.str_)
+    if col == "size":
+        return np.zeros(0, dtype=np.float32)
+    return np.zeros(0, dtype=np.int32)
+
+
+def page_tasks(paths: Iterable[str], sink) -> Iterator[tuple[dict, int | None, str | None]]:
+    """
+    Yield (doc, page_index, error) for every page still to extract.
+
+    Documents are opened one at a time to count their pages; one that
+    cannot be opened yields a single task with page_index None and the
+    error message. Each doc carries the file's stamp (size and mtime), taken
+    before it is read, which the sink compares on resume.
+    """
+    for path in find_pdfs(paths):
+        stamp = file_stamp(path)
+        try:
+            with core.open_document(path) as pdf:
+                page_count = pdf.page_count
+        except Exception as exc:
+            if sink.pending_pages(path, 1, stamp):
+                doc = {"path": path, "hash": path, "stamp": stamp}
+                yield doc, None, f"{type(exc).__name__}: {exc}"
+            continue
+
+        doc = {"name": os.path.basename(path), "path": path, "hash": path, "stamp": stamp}
+        for page_index in sink.pending_pages(path, page_count, stamp):
+            yield doc, page_index, None
+
+
+def extract_corpus(
+    paths: Iterable[str],
+    sink,
+    flags: int,
+    ocr_mode: str,
+    pool: workers.WorkerPool,
+    *,
+    chars: bool = False,
+    progress: bool = True,
+) -> int:
+    """
+    Extract every page of every PDF under paths into sink, in order.
+
+    Pages run in parallel across the pool while at most two pages per
+    worker are in flight, so memory stays bounded by the window rather
+    than the corpus or document size. With chars set, pages also get the
+    chars level. Returns the number of failed pages.
+    """
+    window = pool.size * 2
+    pending: deque[tuple[dict, int | None, Future | str]] = deque()
+    current: list[str | None] = [None]
+    counts = {"pages": 0, "failed": 0}
+
+    def finish_document() -> None:
+        if current[0] is None:
+            return
+        sink.end_document(current[0])
+        pool.release({current[0]})
+        if progress:
+            print(f"{current[0]}: done", file=sys.stderr)
+
+    def write_next() -> None:
+        doc, page_index, result = pending.popleft()
+        if doc["path"] != current[0]:
+            finish_document()
+            current[0] = doc["path"]
+
+        file_size, file_mtime_ns = doc["stamp"] or (None, None)
+        record = {
+            "path": doc["path"],
+            "page": page_index,
+            "file_size": file_size,
+            "file_mtime_ns": file_mtime_ns,
+            "flags": flags,
+            "ocr": ocr_mode,
+        }
+        rects = None
+        if isinstance(result, str):
+            record["error"] = result
+        else:
+            try:
+                rects = result.result()
+            except workers.PageError as exc:
+                record["error"] = str(exc)
+
+        counts["pages"] += 1
+        counts["failed"] += "error" in record
+        sink.write(record, rects)
+
+    with ThreadPoolExecutor(max_workers=pool.size) as ex:
+        try:
+            for doc, page_index, error in page_tasks(paths, sink):
+                if error is None:
+                    error = ex.submit(
+                        pool.extract, doc, page_index, flags, ocr_mode, chars=chars,
+                    )
+                pending.append((doc, page_index, error))
+
+                if len(pending) >= window:
+                    write_next()
+
+            while pending:
+                write_next()
+            finish_document()
+        finally:
+            for _, _, result in pending:
+                if isinstance(result, Future):
+                    result.cancel()
+
+    if progress:
+        print(f"{counts['pages']} pages, {counts['failed']} failed", file=sys.stderr)
+
+    return counts["failed"]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Extract PDF bounding boxes without the Streamlit UI.",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    # Options shared by every subcommand that extracts pages.
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("paths", nargs="+", help="PDF files or directories to search.")
+    common.add_argument(
+        "--flags",
+        help="Comma list of text flags, e.g. 'preserve_ligatures,mediabox_clip' or "
+        "'+dehyphenate,-preserve_images'; "
+        "an integer is used as is. Defaults to the app's extraction settings.",
+    )
+    common.add_argument("--ocr", choices=["off", "auto", "full"], default="off")
+    common.add_argument("--workers", type=int, default=workers.POOL_SIZE)
+    common.add_argument(
+        "--timeout", type=float, default=workers.PAGE_TIMEOUT,
+        help="Per-page time limit in seconds.",
+    )
+    common.add_argument(
+        "--memory-mb", type=int, default=workers.WORKER_MEMORY_MB,
+        help="Per-worker memory limit in MB (0 disables it).",
+    )
+    common.add_argument(
+        "--resume", action="store_true",
+        help="Skip work already in the output instead of overwriting it.",
+    )
+    common.add_argument("-q", "--quiet", action="store_true")
+
+    extract = sub.add_parser(
+        "extract",
+        parents=[common],
+        help="Extract blocks, lines, spans and words of every page.",
+    )
+    extract.add_argument(
+        "-o", "--output", required=True,
+        help="Output file (jsonl) or directory (parquet).",
+    )
+    extract.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    extract.add_argument(
+        "--chars", action="store_true",
+        help="Also extract per-character boxes, code points and origins.",
+    )
+
+    annotate = sub.add_parser(
+        "annotate",
+        parents=[common],
+        help="Write copies of PDFs with the extracted boxes drawn on their pages.",
+    )
+    annotate.add_argument(
+        "-o", "--output", required=True,
+        help="Output directory; the layout of input directories is mirrored.",
+    )
+    annotate.add_argument(
+        "--levels", default="blocks,lines,spans,words",
+        help="Comma list of levels to draw, including 'chars' "
+        "(default: blocks,lines,spans,words).",
+    )
+    annotate.add_argument(
+        "--no-layers", action="store_true",
+        help="Draw boxes directly instead of one toggleable PDF layer per level.",
+    )
+
+    args = parser.parse_args(argv)
+
+    try:
+        flags = parse_flag_spec(args.flags)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    if args.command == "annotate":
+        levels = [level for level in args.levels.split(",") if level]
+        unknown = [level for level in levels if level not in LEVEL_COLUMNS]
+        if unknown:
+            parser.error(f"Invalid level: {', '.join(unknown)}")
+        chars = "chars" in levels
+        sink = AnnotateSink(
+            args.output, args.paths, levels, layers=not args.no_layers, resume=args.resume,
+        )
+    else:
+        chars = args.chars
+        if args.format == "parquet":
+            sink = ParquetSink(args.output, resume=args.resume, chars=chars)
+        else:
+            sink = JsonlSink(args.output, resume=args.resume)
+
+    pool = workers.WorkerPool(args.workers, timeout=args.timeout, memory_mb=args.memory_mb)
+
+    try:
+        failed = extract_corpus(
+            args.paths, sink, flags, args.ocr, pool, chars=chars, progress=not args.quiet,
+        )
+    finally:
+        sink.close()
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import streamlit as st
+
+import caches
+import core
+import handlers
+import instrument
+import shared
+import workers
+
+COMPARE_MIN_IOU = 0.5
+
+
+def compare_enabled() -> bool:
+    return bool(st.session_state.get("compare", False))
+
+
+def current_min_iou() -> float:
+    return float(st.session_state.get("compare_min_iou", COMPARE_MIN_IOU))
+
+
+def comparison_configs(flags: int, ocr_mode: str) -> list[tuple[str, int, str]]:
+    """
+    The (label, flags, ocr_mode) configurations compared against the
+    current settings: each selected flag flipped on its own, then each
+    selected OCR mode.
+    """
+    configs = []
+    for key in st.session_state.get("compare_flags") or []:
+        flag = core.FLAG_MAP[key]
+        sign = "-" if flags & flag else "+"
+        configs.append((f"{sign}{key}", flags ^ flag, ocr_mode))
+
+    for mode in st.session_state.get("compare_ocr") or []:
+        if mode != ocr_mode:
+            configs.append((f"ocr={mode}", flags, mode))
+
+    return configs
+
+
+def compare_page(
+    cache: caches.LRUCache,
+    status: dict,
+    doc: dict,
+    page_index: int,
+    flags: int,
+    ocr_mode: str,
+    configs: list[tuple[str, int, str]],
+    min_iou: float,
+    *,
+    chars: bool = False,
+) -> list[tuple[str, dict | None, dict | None]]:
+    """
+    Extract one page under the base settings and every configuration in
+    parallel across the worker pool, and compare each against the base,
+    including the chars level when chars is set.
+
+    Returns (label, rects, diff) per configuration; rects and diff are None
+    when either extraction failed. Safe to call from worker threads.
+    """
+    targets = [(flags, ocr_mode)] + [(f, o) for _, f, o in configs]
+
+    def extract(target: tuple[int, str]) -> dict | None:
+        return handlers.cached_page(cache, status, doc, page_index, *target, chars=chars)
+
+    with ThreadPoolExecutor(max_workers=len(targets)) as ex:
+        base, *results = ex.map(extract, targets)
+
+    return [
+        (
+            label,
+            rects,
+            core.compare_rects(base, rects, min_iou=min_iou)
+            if base is not None and rects is not None
+            else None,
+        )
+        for (label, _, _), rects in zip(configs, results)
+    ]
+
+
+def comparison_key(doc: dict, page_index: int | None, flags: int, ocr_mode: str) -> tuple:
+    configs = comparison_configs(flags, ocr_mode)
+    return (
+        doc["hash"],
+        page_index,
+        flags,
+        ocr_mode,
+        tuple(configs),
+        current_min_iou(),
+        handlers.chars_enabled(),
+    )
+
+
+@instrument.timed
+def current_page_comparison(flags: int, ocr_mode: str) -> list:
+    """
+    compare_page for the page on screen, kept until the page or any
+    comparison setting changes.
+    """
+    doc = handlers.current_doc()
+    page_index = st.session_state.get("page_index")
+    if not compare_enabled() or doc is None or page_index is None:
+        return []
+
+    key = comparison_key(doc, page_index, flags, ocr_mode)
+    memo = st.session_state.page_comparison
+    if memo is None or memo[0] != key:
+        result = compare_page(
+            shared.BOX_CACHE,
+            st.session_state.page_status,
+            doc,
+            page_index,
+            flags,
+            ocr_mode,
+            comparison_configs(flags, ocr_mode),
+            current_min_iou(),
+            chars=handlers.chars_enabled(),
+        )
+        memo = st.session_state.page_comparison = (key, result)
+
+    return memo[1]
+
+
+def comparison_labels() -> list[str]:
+    configs = comparison_configs(handlers.current_flags(), handlers.current_ocr_mode())
+    return [label for label, _, _ in configs]
+
+
+def comparison_rows(label: str, diff: dict | None, page_index: int | None = None) -> list[dict]:
+    """
+    Table rows of a compare_rects result: one per level, or one error row.
+    """
+    head = {} if page_index is None else {"page": page_index}
+    head["config"] = label
+
+    if diff is None:
+        return [{**head, "error": "extraction failed"}]
+
+    return [
+        {**head, "level": level, **counts}
+        for level, counts in core.diff_counts(diff).items()
+    ]
+
+
+def current_comparison_table() -> list[dict]:
+    rows = []
+    comparison = current_page_comparison(handlers.current_flags(), handlers.current_ocr_mode())
+    for label, _, diff in comparison:
+        rows += comparison_rows(label, diff)
+    return rows
+
+
+@instrument.timed
+def on_compare_document():
+    """
+    Compare every page of the current document under the comparison
+    configurations, keeping only the counts.
+    """
+    doc = handlers.current_doc()
+    if doc is None:
+        return
+
+    flags = handlers.current_flags()
+    ocr_mode = handlers.current_ocr_mode()
+    configs = comparison_configs(flags, ocr_mode)
+    compare = partial(
+        compare_page,
+        shared.BOX_CACHE,
+        st.session_state.page_status,
+        doc,
+        flags=flags,
+        ocr_mode=ocr_mode,
+        configs=configs,
+        min_iou=current_min_iou(),
+        chars=handlers.chars_enabled(),
+    )
+
+    def page_rows(page_index: int) -> list[dict]:
+        rows = []
+        for label, _, diff in compare(page_index):
+            rows += [
+                row for row in comparison_rows(label, diff, page_index)
+                if row.get("error") or any(row[kind] for kind in core.DIFF_COLORS)
+            ]
+        return rows
+
+    with st.spinner(text="Comparing document...", show_time=True):
+        with ThreadPoolExecutor(max_workers=workers.POOL.size) as ex:
+            pages = list(ex.map(page_rows, range(doc["page_count"])))
+
+    st.session_state.doc_comparison = (
+        comparison_key(doc, None, flags, ocr_mode),
+        [row for rows in pages for row in rows],
+    )
+
+
+def current_doc_comparison() -> list[dict] | None:
+    """
+    Rows of pages that differ from the last document comparison, or None
+    if it was run for another document or other settings.
+    """
+    doc = handlers.current_doc()
+    memo = st.session_state.get("doc_comparison")
+    if not compare_enabled() or doc is None or memo is None:
+        return None
+
+    key = comparison_key(doc, None, handlers.current_flags(), handlers.current_ocr_mode())
+    if memo[0] != key:
+        return None
+    return memo[1]
+
+
+def page_diff_boxes(flags: int, ocr_mode: str) -> dict | None:
+    """
+    Boxes of the highlighted comparison on the page on screen, by level and
+    DIFF_COLORS kind. Every level is included, so the page figure does not
+    change with the selected level.
+    """
+    doc = handlers.current_doc()
+    page_index = st.session_state.get("page_index")
+    if not compare_enabled() or doc is None or page_index is None:
+        return None
+
+    rects = handlers.page_rects(doc, page_index, flags, ocr_mode, chars=handlers.chars_enabled())
+    if rects is None:
+        return None
+
+    highlight = st.session_state.get("compare_highlight")
+    for label, other, diff in current_page_comparison(flags, ocr_mode):
+        if label != highlight or diff is None:
+            continue
+        return {
+            level: {
+                "removed": rects[level]["bbox"][table["removed"]],
+                "added": other[level]["bbox"][table["added"]],
+                "shifted": other[level]["bbox"][table["shifted"]],
+            }
+            for level, table in diff.items()
+        }
+
+    return None
@@ -1,17 +1,24 @@
-from typing import Literal, Dict, Iterable
+from functools import partial
+from typing import Callable, Literal, Dict, Iterable
+import hashlib
+import threading
 import base64
+import numpy as np
 import pymupdf
 from PIL import Image
 import io
-import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle
-import plotly.graph_objects as go
+import struct
+import zlib
+
+from caches import DiskCache
+import instrument
 
 COLORS = {
     "blocks": (1, 0, 0),
     "lines": (0, 0, 1),
     "spans": (0, 1, 0),
     "words": (1, 0.5, 0),
+    "chars": (0.6, 0, 0.8),
 }
 
 FLAG_MAP = {
@@ -28,43 +35,79 @@ FLAG_MAP = {
     "text_segment": pymupdf.TEXT_SEGMENT,
 }
 
-def init_docs(uploads: Iterable, dpi: int = 450) -> list[dict]:
+# PyMuPDF is not thread-safe. The app does page work in worker processes;
+# the few MuPDF calls it makes in its own process (init_docs,
+# render_page_images, annotate_document) hold this lock themselves, since
+# the script threads of several sessions can make them at once. Functions
+# that take an open document do not take it.
+MUPDF_LOCK = threading.RLock()
+
+DIFF_COLORS = {
+    "removed": (1, 0, 0),
+    "added": (0, 0.7, 0),
+    "shifted": (1, 0.6, 0),
+}
+
+EXPORT_LINE_WIDTH = 0.5  # box outline width in annotated PDFs, in points
+
+SPAN_FLAGS = {
+    1: "superscript",
+    2: "italic",
+    4: "serif",
+    8: "monospaced",
+    16: "bold",
+}
+
+RECTS_VERSION = 3  # bump when extract_rects columns change; part of cache keys
+
+RASTER_VERSION = 3  # bump when the raster cache format changes; part of cache keys
+
+MATCH_CHUNK = 256  # rows of boxes compared at once when matching
+
+TILE_PX = 512  # edge length of a deep-zoom tile in pixels
+
+COLORSPACES = {
+    "rgb": pymupdf.csRGB,
+    "gray": pymupdf.csGRAY,
+}
+
+DISPLAY_SCALE = 2  # device pixels per figure pixel targeted by tiles
+
+@instrument.timed
+def init_docs(uploads: Iterable, existing: Iterable[dict] = ()) -> list[dict]:
     """
     Initialize document and page records from uploaded PDFs.
 
-    - Renders each page to a PIL image at the given DPI.
-    - Stores immutable PDF bytes once per document.
-    - Initializes page-level extraction slots as None.
+    - Stores immutable PDF bytes and their content hash once per document.
+    - Records the page count; page images are rendered on demand and kept
+      outside the record.
+    - Reuses records from existing whose content hash matches an upload,
+      renamed if needed, so the bytes of identical files are kept once and
+      the document is not reopened.
 
     Returns a list of document dicts sorted by name.
     """
+    known = {d["hash"]: d for d in existing}
     docs: list[dict] = []
 
     for file in uploads:
         pdf_bytes = file.getvalue()
-        pages: list[dict] = []
-
-        with pymupdf.open(stream=pdf_bytes, filetype="pdf") as pdf:
-            for page in pdf:
-                pix = page.get_pixmap(dpi=dpi)
-                png_bytes = pix.tobytes("png")
-                img = Image.open(io.BytesIO(png_bytes))
-
-                pages.append(
-                    {
-                        "image": img,
-                        "blocks": None,
-                        "lines": None,
-                        "spans": None,
-                        "words": None,
-                    }
-                )
+        pdf_hash = content_hash(pdf_bytes)
+
+        doc = known.get(pdf_hash)
+        if doc is not None:
+            docs.append(doc if doc["name"] == file.name else {**doc, "name": file.name})
+            continue
+
+        with MUPDF_LOCK, open_document(pdf_bytes) as pdf:
+            page_count = pdf.page_count
 
         docs.append(
             {
                 "name": file.name,
                 "bytes": pdf_bytes,
-                "pages": pages,
+                "hash": pdf_hash,
+                "page_count": page_count,
             }
         )
 
@@ -72,6 +115,157 @@ def init_docs(uploads: Iterable, dpi: int = 450) -> list[dict]:
     return docs
 
 
+@instrument.timed
+def render_page_images(
+    pdf_bytes: bytes,
+    page_indices: Iterable[int],
+    dpi: int,
+    *,
+    colorspace: str = "rgb",
+) -> list[Image.Image]:
+    """
+    Render the given pages of a PDF to PIL images at the given DPI.
+
+    - Images wrap the raw pixmap samples, without a PNG round-trip.
+    - colorspace is a COLORSPACES key; "gray" images take a third of the
+      memory of "rgb" ones.
+
+    Returns images in the order of page_indices.
+    """
+    with MUPDF_LOCK, open_document(pdf_bytes) as pdf:
+        return [
+            image_from_pixels(render_pixels(pdf, i, dpi, colorspace=colorspace))
+            for i in page_indices
+        ]
+
+
+@instrument.timed
+def load_page_images(
+    doc: dict,
+    page_indices: Iterable[int],
+    dpi: int,
+    *,
+    render: Callable[[list[int]], list[Image.Image | None]] | None = None,
+    cache: DiskCache | None = None,
+    colorspace: str = "rgb",
+) -> list[Image.Image | None]:
+    """
+    Load page images for a document record, checking the raster cache first.
+
+    - Pages missing from the cache are rendered with render(page_indices),
+      which defaults to in-process render_page_images and may return None
+      for pages that failed.
+    - Rendered pages are stored under (content hash, page index, DPI,
+      colorspace), compressed and written by the cache's background thread
+      so the caller does not wait for either.
+
+    Returns images in the order of page_indices, None where rendering failed.
+    """
+    page_indices = list(page_indices)
+    images: dict[int, Image.Image | None] = {}
+
+    if render is None:
+        def render(indices: list[int]) -> list[Image.Image]:
+            return render_page_images(doc["bytes"], indices, dpi, colorspace=colorspace)
+
+    if cache is not None:
+        for i in page_indices:
+            data = cache.get(raster_key(doc["hash"], i, dpi, colorspace))
+            if data is not None:
+                images[i] = raster_from_bytes(data)
+
+    missing = [i for i in page_indices if i not in images]
+    if missing:
+        for i, image in zip(missing, render(missing)):
+            images[i] = image
+            if cache is not None and image is not None:
+                cache.put_later(
+                    raster_key(doc["hash"], i, dpi, colorspace),
+                    partial(raster_to_bytes, image),
+                )
+
+    return [images[i] for i in page_indices]
+
+
+def tile_dpi(
+    page_width: float,
+    region_width: float,
+    base_dpi: int,
+    max_dpi: int,
+) -> int | None:
+    """
+    Pick the pyramid level for showing region_width points of a page.
+
+    Levels double from base_dpi. The figure is page_width pixels wide, so a
+    region that spans it needs 72 * page_width / region_width DPI, times
+    DISPLAY_SCALE for high-density screens.
+
+    Returns None when the base image is already sharp enough.
+    """
+    needed = DISPLAY_SCALE * 72 * page_width / max(region_width, 1e-6)
+    dpi = base_dpi
+    while dpi < needed and dpi < max_dpi:
+        dpi *= 2
+
+    dpi = min(dpi, max_dpi)
+    return dpi if dpi > base_dpi else None
+
+
+def page_tiles(
+    page_size: tuple[float, float],
+    region: tuple[float, float, float, float],
+    dpi: int,
+) -> list[tuple[int, int, tuple[float, float, float, float]]]:
+    """
+    List the tiles of one pyramid level that overlap a page region.
+
+    Tiles are TILE_PX pixels square at the given DPI, clipped to the page.
+    Returns (column, row, clip) tuples with clip in page coordinates.
+    """
+    width, height = page_size
+    size = TILE_PX * 72 / dpi
+    x0, y0, x1, y1 = region
+
+    cols = range(
+        max(0, int(x0 // size)),
+        min(int(np.ceil(width / size)), int(np.ceil(x1 / size))),
+    )
+    rows = range(
+        max(0, int(y0 // size)),
+        min(int(np.ceil(height / size)), int(np.ceil(y1 / size))),
+    )
+
+    tiles = []
+    for row in rows:
+        for col in cols:
+            clip = (
+                col * size,
+                row * size,
+                min((col + 1) * size, width),
+                min((row + 1) * size, height),
+            )
+            tiles.append((col, row, clip))
+
+    return tiles
+
+
+@instrument.timed
+def render_tile(
+    pdf: pymupdf.Document,
+    page_index: int,
+    clip: tuple[float, float, float, float],
+    dpi: int,
+    *,
+    colorspace: str = "rgb",
+) -> Image.Image:
+    """
+    Render one clipped region of a page at the given DPI.
+    """
+    return image_from_pixels(
+        render_pixels(pdf, page_index, dpi, clip=clip, colorspace=colorspace)
+    )
+
+
 def resolve_text_flags(state: dict) -> int:
     """
     Resolve Streamlit boolean session state flags into a PyMuPDF flag integer.
@@ -89,84 +283,542 @@ def resolve_text_flags(state: dict) -> int:
     return flags
 
 
+def open_document(source: bytes | str) -> pymupdf.Document:
+    """
+    Parse PDF bytes, or open a PDF file by path, into a document handle
+    that can be reused across pages. A file is read on demand rather than
+    loaded whole.
+
+    The caller owns the handle and must close it.
+    """
+    if isinstance(source, str):
+        return pymupdf.open(source, filetype="pdf")
+
+    return pymupdf.open(stream=source, filetype="pdf")
+
+
+@instrument.timed
 def get_textpage(
-    pdf_bytes: bytes,
+    pdf: pymupdf.Document,
     page_index: int,
     flags: int,
     ocr_mode: Literal["off", "auto", "full"],
 ) -> pymupdf.TextPage:
-    with pymupdf.open(stream=pdf_bytes, filetype="pdf") as pdf:
-        page = pdf[page_index]
+    page = pdf[page_index]
 
-        if ocr_mode == "off":
-            return page.get_textpage(flags=flags)
+    if ocr_mode == "off":
+        return page.get_textpage(flags=flags)
 
-        if ocr_mode == "auto":
-            return page.get_textpage_ocr(flags=flags)
+    if ocr_mode == "auto":
+        return page.get_textpage_ocr(flags=flags)
 
-        if ocr_mode == "full":
-            return page.get_textpage_ocr(flags=flags, full=True)
+    if ocr_mode == "full":
+        return page.get_textpage_ocr(flags=flags, full=True)
 
     raise ValueError(f"Invalid ocr_mode: {ocr_mode}")
 
-def extract_rects(textpage: pymupdf.TextPage) -> Dict[str, list[pymupdf.Rect]]:
+@instrument.timed
+def extract_page(
+    pdf: pymupdf.Document,
+    page_index: int,
+    flags: int,
+    ocr_mode: Literal["off", "auto", "full"],
+    *,
+    cache: DiskCache | None = None,
+    chars: bool = False,
+) -> Dict[str, Dict[str, np.ndarray]]:
     """
-    Extract bounding boxes from a TextPage, normalized to page coordinates.
+    Extract the rects of one page: get_textpage followed by extract_rects,
+    plus extract_chars on the same TextPage when chars is set.
 
-    Returns a dict with keys: blocks, lines, spans, words.
+    OCR results are stored in cache, keyed by the page content hash, OCR
+    mode and flags, so the same page is never sent to Tesseract twice. They
+    always include the chars level, which costs little next to the OCR, so
+    asking for the characters later does not run it again.
     """
-    out: Dict[str, list[pymupdf.Rect]] = {}
+    key = None
+    if cache is not None and ocr_mode != "off":
+        key = f"{page_hash(pdf, page_index)}-{ocr_mode}-{flags}-v{RECTS_VERSION}"
+        data = cache.get(key)
+        if data is not None:
+            rects = rects_from_bytes(data)
+            if not chars:
+                rects.pop("chars", None)
+            return rects
 
+    textpage = get_textpage(pdf, page_index, flags, ocr_mode)
+    rects = extract_rects(textpage)
+    if chars or key is not None:
+        rects["chars"] = extract_chars(textpage)
+
+    if key is not None:
+        cache.put(key, rects_to_bytes(rects))
+        if not chars:
+            rects.pop("chars")
+
+    return rects
+
+
+@instrument.timed
+def extract_rects(textpage: pymupdf.TextPage) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Extract bounding boxes from a TextPage in one pass over its structure.
+
+    Returns a dict with keys: blocks, lines, spans, words. Each level is a
+    table of columns:
+    - "bbox": float32 N×4 array of (x0, y0, x1, y1) in page coordinates.
+    - "block": int32 row of the parent block (lines, spans, words).
+    - "line": int32 row of the parent line (spans, words), -1 if unknown.
+    - "text": str array of the span or word text (spans, words).
+    - "font", "size", "flags": font name, float32 font size and int32
+      PyMuPDF font flags of each span (spans).
+    """
     d = textpage.extractDICT(sort=True)
 
-    out["blocks"] = [
-        pymupdf.Rect(b["bbox"])
-        for b in d.get("blocks", [])
-        if "bbox" in b
-    ]
+    block_boxes: list = []
+    line_boxes: list = []
+    span_boxes: list = []
+    span_text: list[str] = []
+    span_font: list[str] = []
+    span_size: list[float] = []
+    span_flags: list[int] = []
+    line_block: list[int] = []
+    span_line: list[int] = []
+    line_rows: dict[tuple[int, int], int] = {}
+    text_numbers: list[int] = []
 
-    out["lines"] = [
-        pymupdf.Rect(line["bbox"])
-        for block in d.get("blocks", [])
-        for line in block.get("lines", [])
-        if "bbox" in line
-    ]
+    for block in d.get("blocks", []):
+        block_row = len(block_boxes)
+        block_boxes.append(block["bbox"])
 
-    out["spans"] = [
-        pymupdf.Rect(span["bbox"])
-        for block in d.get("blocks", [])
-        for line in block.get("lines", [])
-        for span in line.get("spans", [])
-        if "bbox" in span
-    ]
+        if block.get("type") == 0:
+            text_numbers.append(block["number"])
+
+        for line_no, line in enumerate(block.get("lines", [])):
+            line_row = len(line_boxes)
+            line_rows[(block["number"], line_no)] = line_row
+            line_boxes.append(line["bbox"])
+            line_block.append(block_row)
 
-    out["words"] = [
-        pymupdf.Rect(w[0], w[1], w[2], w[3])
-        for w in textpage.extractWORDS()
+            for span in line.get("spans", []):
+                span_boxes.append(span["bbox"])
+                span_line.append(line_row)
+                span_text.append(span["text"])
+                span_font.append(span["font"])
+                span_size.append(span["size"])
+                span_flags.append(span["flags"])
+
+    # extractWORDS numbers blocks by their position among text blocks in
+    # unsorted page order.
+    text_numbers.sort()
+    words = textpage.extractWORDS()
+    word_line = [
+        line_rows.get((text_numbers[w[5]], w[6]), -1)
+        if w[5] < len(text_numbers)
+        else -1
+        for w in words
     ]
 
-    return out
+    lines_block = np.asarray(line_block, dtype=np.int32)
+    spans_line = np.asarray(span_line, dtype=np.int32)
+    words_line = np.asarray(word_line, dtype=np.int32)
+
+    return {
+        "blocks": {
+            "bbox": _boxes(block_boxes),
+        },
+        "lines": {
+            "bbox": _boxes(line_boxes),
+            "block": lines_block,
+        },
+        "spans": {
+            "bbox": _boxes(span_boxes),
+            "line": spans_line,
+            "block": lines_block[spans_line],
+            "text": _strings(span_text),
+            "font": _strings(span_font),
+            "size": np.asarray(span_size, dtype=np.float32),
+            "flags": np.asarray(span_flags, dtype=np.int32),
+        },
+        "words": {
+            "bbox": _boxes([w[:4] for w in words]),
+            "line": words_line,
+            "block": np.where(words_line >= 0, lines_block[words_line], -1).astype(np.int32),
+            "text": _strings([w[4] for w in words]),
+        },
+    }
+
+
+@instrument.timed
+def extract_chars(textpage: pymupdf.TextPage) -> Dict[str, np.ndarray]:
+    """
+    Extract per-character boxes from a TextPage as a level table.
+
+    Columns:
+    - "bbox": float32 N×4 array of character boxes in page coordinates.
+    - "codepoint": int32 Unicode code point of each character.
+    - "origin": float32 N×2 array of glyph origins (baseline start).
+    - "span": int32 row of the parent span in extract_rects "spans".
+
+    Spans are numbered in the same sorted order as extract_rects, so the
+    rows line up with its result for the same TextPage.
+    """
+    d = textpage.extractRAWDICT(sort=True)
+
+    boxes: list = []
+    origins: list = []
+    codepoints: list[int] = []
+    counts: list[int] = []
+
+    for block in d.get("blocks", []):
+        for line in block.get("lines", []):
+            for span in line.get("spans", []):
+                span_chars = span.get("chars", [])
+                counts.append(len(span_chars))
+                for char in span_chars:
+                    boxes.append(char["bbox"])
+                    origins.append(char["origin"])
+                    codepoints.append(ord(char["c"]) if char["c"] else 0)
+
+    return {
+        "bbox": _boxes(boxes),
+        "codepoint": np.asarray(codepoints, dtype=np.int32),
+        "origin": np.asarray(origins, dtype=np.float32).reshape(-1, 2),
+        "span": np.repeat(np.arange(len(counts), dtype=np.int32), counts),
+    }
+
+
+def rects_text(
+    rects: Dict[str, Dict[str, np.ndarray]],
+    level: str,
+    rows: Iterable[int],
+) -> list[str]:
+    """
+    Text of the given rows of a level. Lines join their spans and blocks
+    join their lines with newlines; image blocks have no text.
+    """
+    spans = rects["spans"]
+    if level == "chars":
+        return [chr(c) for c in rects["chars"]["codepoint"][list(rows)]]
+
+    if level in ("spans", "words"):
+        return [str(rects[level]["text"][row]) for row in rows]
+
+    if level == "lines":
+        return ["".join(spans["text"][spans["line"] == row]) for row in rows]
+
+    lines = rects["lines"]
+    texts = []
+    for row in rows:
+        line_rows = np.flatnonzero(lines["block"] == row)
+        texts.append("\n".join(rects_text(rects, "lines", line_rows)))
+    return texts
+
+
+def span_flag_names(flags: int) -> str:
+    """
+    Comma-separated names of the PyMuPDF font flags set in flags.
+    """
+    return ", ".join(name for bit, name in SPAN_FLAGS.items() if flags & bit)
+
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Intersection over union of every box in a against every box in b,
+    as a len(a)×len(b) float32 array.
+    """
+    ix0 = np.maximum(a[:, None, 0], b[None, :, 0])
+    iy0 = np.maximum(a[:, None, 1], b[None, :, 1])
+    ix1 = np.minimum(a[:, None, 2], b[None, :, 2])
+    iy1 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(ix1 - ix0, 0, None) * np.clip(iy1 - iy0, 0, None)
+
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+@instrument.timed
+def match_boxes(
+    a: np.ndarray,
+    b: np.ndarray,
+    *,
+    min_iou: float = 0.5,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Match boxes one-to-one between two N×4 arrays by IoU.
+
+    Two boxes match when each is the other's best overlap and their IoU is
+    at least min_iou. Unmatched boxes are matched again among themselves
+    until no new pairs are found, which pairs up duplicate boxes.
+
+    Returns (rows of a, rows of b, IoU) of the matched pairs.
+    """
+    a = _solid(a)
+    b = _solid(b)
+    a_rows = np.arange(len(a))
+    b_rows = np.arange(len(b))
+    matched: list[tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+
+    while len(a_rows) and len(b_rows):
+        ia, ib, iou = _mutual_best(a[a_rows], b[b_rows], min_iou)
+        if not len(ia):
+            break
+
+        matched.append((a_rows[ia], b_rows[ib], iou))
+        a_rows = np.delete(a_rows, ia)
+        b_rows = np.delete(b_rows, ib)
+
+    if not matched:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0, dtype=np.float32)
+
+    return tuple(np.concatenate(parts) for parts in zip(*matched))
+
+
+def _solid(boxes: np.ndarray) -> np.ndarray:
+    # Give empty boxes a tiny area so identical ones still overlap.
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4).copy()
+    boxes[:, 2] = np.maximum(boxes[:, 2], boxes[:, 0] + 1e-3)
+    boxes[:, 3] = np.maximum(boxes[:, 3], boxes[:, 1] + 1e-3)
+    return boxes
+
+
+def _mutual_best(
+    a: np.ndarray,
+    b: np.ndarray,
+    min_iou: float,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pairs of rows that are each other's best IoU match.
+
+    Both arrays are sorted by y0 and each block of MATCH_CHUNK rows of a is
+    only compared with the band of b that can vertically overlap it, so
+    text pages cost far less than a full len(a)×len(b) IoU matrix.
+    """
+    order_a = np.argsort(a[:, 1], kind="stable")
+    order_b = np.argsort(b[:, 1], kind="stable")
+    a = a[order_a]
+    b = b[order_b]
+    b_y0 = b[:, 1]
+    b_height = float((b[:, 3] - b[:, 1]).max())
+
+    row_best = np.full(len(a), -1, dtype=np.int64)
+    row_iou = np.zeros(len(a), dtype=np.float32)
+    col_best = np.full(len(b), -1, dtype=np.int64)
+    col_iou = np.zeros(len(b), dtype=np.float32)
+
+    for start in range(0, len(a), MATCH_CHUNK):
+        chunk = a[start:start + MATCH_CHUNK]
+        lo = np.searchsorted(b_y0, chunk[:, 1].min() - b_height, side="left")
+        hi = np.searchsorted(b_y0, chunk[:, 3].max(), side="right")
+        if lo >= hi:
+            continue
+
+        iou = box_iou(chunk, b[lo:hi])
+
+        best = iou.argmax(axis=1)
+        row_best[start:start + len(chunk)] = best + lo
+        row_iou[start:start + len(chunk)] = iou[np.arange(len(chunk)), best]
+
+        best = iou.argmax(axis=0)
+        best_iou = iou[best, np.arange(hi - lo)]
+        better = best_iou > col_iou[lo:hi]
+        col_best[lo:hi][better] = best[better] + start
+        col_iou[lo:hi][better] = best_iou[better]
+
+    rows = np.flatnonzero(row_iou >= min_iou)
+    rows = rows[col_best[row_best[rows]] == rows]
+
+    return order_a[rows], order_b[row_best[rows]], row_iou[rows]
+
+
+@instrument.timed
+def compare_rects(
+    base: Dict[str, Dict[str, np.ndarray]],
+    other: Dict[str, Dict[str, np.ndarray]],
+    *,
+    min_iou: float = 0.5,
+    shift_tol: float = 0.5,
+) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Compare two extract_rects results level by level, over the levels
+    both have.
+
+    For each level returns rows of:
+    - "removed": base boxes with no match in other.
+    - "added": other boxes with no match in base.
+    - "shifted": other boxes whose matched base box (same position in
+      "shifted_base") differs by more than shift_tol points on any edge.
+    """
+    diff = {}
+    for level, table in base.items():
+        if level not in other:
+            continue
+        a = table["bbox"]
+        b = other[level]["bbox"]
+        ia, ib, _ = match_boxes(a, b, min_iou=min_iou)
+
+        moved = np.abs(a[ia] - b[ib]).max(axis=1, initial=0) > shift_tol
+        diff[level] = {
+            "removed": np.setdiff1d(np.arange(len(a)), ia),
+            "added": np.setdiff1d(np.arange(len(b)), ib),
+            "shifted": ib[moved],
+            "shifted_base": ia[moved],
+        }
+
+    return diff
+
+
+def diff_counts(diff: Dict[str, Dict[str, np.ndarray]]) -> Dict[str, Dict[str, int]]:
+    """
+    Number of removed, added and shifted boxes per level of a compare_rects result.
+    """
+    return {
+        level: {kind: len(table[kind]) for kind in DIFF_COLORS}
+        for level, table in diff.items()
+    }
 
 
 # --- Helper functions ---
 
-def rects_to_pixels(
-    rects: Iterable[pymupdf.Rect],
+@instrument.timed
+def render_pixels(
+    pdf: pymupdf.Document,
+    page_index: int,
     dpi: int,
-) -> list[tuple[float, float, float, float]]:
+    *,
+    clip: tuple[float, float, float, float] | None = None,
+    colorspace: str = "rgb",
+) -> tuple[int, int, bytes]:
     """
-    Convert page-space rects (points) to pixel-space tuples.
+    Rasterize one page, or a clipped region of it, to raw RGB or gray samples.
+
+    Returns (width, height, samples); cheap to send between processes.
     """
-    scale = dpi / 72
-    return [
-        (r.x0 * scale, r.y0 * scale, r.x1 * scale, r.y1 * scale)
-        for r in rects
-    ]
+    rect = pymupdf.Rect(clip) if clip is not None else None
+    pix = pdf[page_index].get_pixmap(
+        dpi=dpi,
+        clip=rect,
+        colorspace=COLORSPACES[colorspace],
+        alpha=False,
+    )
+    return pix.width, pix.height, pix.samples
+
+
+def image_from_pixels(pixels: tuple[int, int, bytes]) -> Image.Image:
+    width, height, samples = pixels
+    mode = "L" if len(samples) == width * height else "RGB"
+    return Image.frombuffer(mode, (width, height), samples, "raw", mode, 0, 1)
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def raster_key(doc_hash: str, page_index: int, dpi: int, colorspace: str = "rgb") -> str:
+    return f"{doc_hash}-{page_index}-{dpi}-{colorspace}-v{RASTER_VERSION}"
+
+
+def raster_to_bytes(image: Image.Image) -> bytes:
+    """
+    Serialize a page image for the raster cache: its size and its samples
+    compressed with zlib at level 1.
+
+    This is about as small as PNG at compress_level=1 (2-8 MB for a 450
+    DPI RGB page instead of 59 MB raw) and decodes in about half the time,
+    since there are no PNG filters to undo.
+    """
+    return struct.pack("<II", *image.size) + zlib.compress(image.tobytes(), 1)
+
+
+def raster_from_bytes(data: bytes) -> Image.Image:
+    """
+    Inverse of raster_to_bytes.
+    """
+    width, height = struct.unpack_from("<II", data)
+    return image_from_pixels((width, height, zlib.decompress(memoryview(data)[8:])))
+
+
+@instrument.timed
+def page_hash(pdf: pymupdf.Document, page_index: int) -> str:
+    """
+    Hash what a page looks like: its geometry, content stream and the raw
+    streams of the images, fonts and form XObjects it uses.
+    """
+    page = pdf[page_index]
+    h = hashlib.sha256()
+    h.update(repr((tuple(page.rect), page.rotation)).encode())
+    h.update(page.read_contents())
+
+    xrefs = {img[0] for img in page.get_images()}
+    xrefs |= {font[0] for font in page.get_fonts()}
+    xrefs |= {xobj[0] for xobj in page.get_xobjects()}
+    for xref in sorted(xrefs):
+        if xref > 0 and pdf.xref_is_stream(xref):
+            h.update(pdf.xref_stream_raw(xref))
+
+    return h.hexdigest()
+
+
+@instrument.timed
+def rects_to_bytes(rects: Dict[str, Dict[str, np.ndarray]]) -> bytes:
+    """
+    Serialize an extract_rects result to .npz bytes.
+    """
+    buf = io.BytesIO()
+    np.savez(
+        buf,
+        **{
+            f"{level}.{name}": col
+            for level, cols in rects.items()
+            for name, col in cols.items()
+        },
+    )
+    return buf.getvalue()
+
+
+@instrument.timed
+def rects_from_bytes(data: bytes) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Inverse of rects_to_bytes.
+    """
+    rects: Dict[str, Dict[str, np.ndarray]] = {}
+    with np.load(io.BytesIO(data)) as npz:
+        for name in npz.files:
+            level, col = name.split(".", 1)
+            rects.setdefault(level, {})[col] = npz[name]
+    return rects
+
+
+def rects_nbytes(rects: Dict[str, Dict[str, np.ndarray]]) -> int:
+    """
+    Memory held by the arrays of an extract_rects result.
+    """
+    return sum(col.nbytes for level in rects.values() for col in level.values())
+
+
+def _boxes(boxes: list) -> np.ndarray:
+    return np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+
+
+def _strings(values: list[str]) -> np.ndarray:
+    # Fixed-width unicode rather than object arrays, so .npz needs no pickle.
+    return np.asarray(values, dtype=np.str_).reshape(-1)
+
+
+def rects_to_pixels(rects: np.ndarray, dpi: int) -> np.ndarray:
+    """
+    Convert a page-space N×4 box array (points) to pixel space.
+    """
+    return rects * np.float32(dpi / 72)
 
 
 def render_page_figure(
     image: Image.Image,
-    rects: Iterable[pymupdf.Rect] | None,
+    rects: np.ndarray | None,
     dpi: int,
     *,
     facecolor: str = "yellow",
@@ -176,16 +828,20 @@ def render_page_figure(
     """
     Render a page image with optional highlighted rectangles.
 
-    Returns a matplotlib Figure. No state is mutated.
+    Returns a matplotlib Figure. No state is mutated. matplotlib is only
+    imported here, so the app and workers start without it.
     """
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Rectangle
+
     fig, ax = plt.subplots()
     ax.imshow(image)
     ax.set_xlim(0, image.width)
     ax.set_ylim(image.height, 0)
     ax.axis("off")
 
-    if rects:
-        for x0, y0, x1, y1 in rects_to_pixels(rects, dpi):
+    if rects is not None and len(rects):
+        for x0, y0, x1, y1 in rects_to_pixels(rects, dpi).tolist():
             ax.add_patch(
                 Rectangle(
                     (x0, y0),
@@ -201,21 +857,221 @@ def render_page_figure(
     return fig
 
 
+def box_path(page: pymupdf.Page, boxes: np.ndarray) -> str:
+    """
+    PDF path operators drawing a page-space N×4 box array as rectangles,
+    as Shape.draw_rect would, built for the whole array at once.
+    """
+    m = ~page.transformation_matrix
+    b = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    x = b[:, 0] * m.a + b[:, 3] * m.c + m.e
+    y = b[:, 0] * m.b + b[:, 3] * m.d + m.f
+    ops = np.column_stack([x, y, b[:, 2] - b[:, 0], b[:, 3] - b[:, 1]])
+    return "".join("%g %g %g %g re\n" % tuple(row) for row in ops.tolist())
+
+
+def add_level_layers(pdf: pymupdf.Document, levels: Iterable[str]) -> dict[str, int]:
+    """
+    Add one optional content group per level, shown by default; PDF
+    viewers list them as layers. Returns the group xref per level.
+    """
+    return {level: pdf.add_ocg(level, on=True) for level in levels}
+
+
+@instrument.timed
+def annotate_page(
+    page: pymupdf.Page,
+    rects: dict,
+    levels: Iterable[str],
+    *,
+    layers: dict[str, int] | None = None,
+) -> None:
+    """
+    Draw the boxes of each level onto a PDF page as vector outlines in the
+    level's COLORS, one path per level.
+
+    layers maps levels to optional content group xrefs from
+    add_level_layers; without it the boxes are drawn unconditionally.
+    Levels missing from rects are skipped.
+    """
+    for level in levels:
+        if level not in rects or not len(rects[level]["bbox"]):
+            continue
+        boxes = rects[level]["bbox"]
+
+        shape = page.new_shape()
+        shape.draw_cont = box_path(page, boxes)
+        shape.finish(
+            color=COLORS[level],
+            width=EXPORT_LINE_WIDTH,
+            oc=layers.get(level, 0) if layers else 0,
+        )
+        shape.commit()
+
+
+@instrument.timed
+def annotate_document(
+    source: bytes | str,
+    pages: Iterable[tuple[int, dict | None]],
+    levels: Iterable[str],
+    *,
+    layers: bool = True,
+    output: str | None = None,
+) -> bytes | None:
+    """
+    Write a copy of a PDF with the extracted boxes drawn on its pages.
+
+    - pages yields (page_index, rects) and is consumed as it goes, so the
+      rects of a document need not all be held at once. Pages with rects
+      of None are copied unchanged.
+    - layers puts each level in its own optional content group.
+    - Nothing is rasterized: the original page content is kept as is.
+    - MuPDF work is done under MUPDF_LOCK, released while waiting for pages.
+
+    Saves to output if given and returns None; otherwise returns the PDF.
+    """
+    levels = list(levels)
+    with MUPDF_LOCK:
+        pdf = open_document(source)
+
+    try:
+        with MUPDF_LOCK:
+            groups = add_level_layers(pdf, levels) if layers else None
+
+        for page_index, rects in pages:
+            if rects is not None:
+                with MUPDF_LOCK:
+                    annotate_page(pdf[page_index], rects, levels, layers=groups)
+
+        with MUPDF_LOCK:
+            if output is not None:
+                pdf.save(output, garbage=1, deflate=True)
+                return None
+            return pdf.tobytes(garbage=1, deflate=True)
+    finally:
+        with MUPDF_LOCK:
+            pdf.close()
+
+
+@instrument.timed
+def encode_image(
+    image: Image.Image,
+    fmt: Literal["png", "jpeg", "webp"] = "png",
+    quality: int = 85,
+) -> str:
+    """
+    Encode a page image as a base64 data URI for the browser.
+
+    quality applies to the lossy formats (jpeg, webp) only.
+    """
+    buf = io.BytesIO()
+    if fmt == "png":
+        image.save(buf, format="PNG")
+    elif fmt == "jpeg":
+        image.save(buf, format="JPEG", quality=quality)
+    elif fmt == "webp":
+        image.save(buf, format="WEBP", quality=quality)
+    else:
+        raise ValueError(f"Invalid image format: {fmt}")
+
+    return f"data:image/{fmt};base64,{base64.b64encode(buf.getvalue()).decode('utf-8')}"
+
+
+def box_traces(
+    rects: np.ndarray,
+    fill: str,
+    *,
+    name: str,
+    visible: bool | str = True,
+    legend: bool = False,
+    group: str | None = None,
+) -> list:
+    """
+    Build the Plotly traces that draw an N×4 box array as one overlay.
+
+    - A single filled scatter path draws every box, with gaps between them.
+    - A WebGL marker trace at the box centers carries per-box hover data.
+    - Both share a legend group (group, or name by default), so with legend
+      set one legend entry shows or hides the overlay in the browser.
+    """
+    group = group or name
+    import plotly.graph_objects as go
+
+    x0, y0, x1, y1 = rects.T
+    gap = np.full(len(rects), np.nan, dtype=np.float32)
+    # fill="toself" closes each gap-separated corner run into a box.
+    path_x = np.column_stack([x0, x1, x1, x0, gap]).ravel()
+    path_y = np.column_stack([y0, y0, y1, y1, gap]).ravel()
+
+    outline = go.Scatter(
+        x=path_x,
+        y=path_y,
+        mode="lines",
+        fill="toself",
+        fillcolor=fill,
+        line=dict(width=0),
+        opacity=0.6,
+        hoverinfo="skip",
+        name=name,
+        legendgroup=group,
+        showlegend=legend,
+        visible=visible,
+    )
+
+    hover = go.Scattergl(
+        x=(x0 + x1) / 2,
+        y=(y0 + y1) / 2,
+        mode="markers",
+        marker=dict(size=6, opacity=0),
+        customdata=rects,
+        hovertemplate=(
+            f"{name} %{{pointNumber}}<br>"
+            "x0=%{customdata[0]:.1f} y0=%{customdata[1]:.1f}<br>"
+            "x1=%{customdata[2]:.1f} y1=%{customdata[3]:.1f}"
+            "<extra></extra>"
+        ),
+        name=name,
+        legendgroup=group,
+        showlegend=False,
+        visible=visible,
+    )
+
+    return [outline, hover]
+
+
+@instrument.timed
 def render_page_plotly(
     image: Image.Image,
-    rects: Iterable[pymupdf.Rect] | None,
+    rects: np.ndarray | None,
     dpi: int,
     *,
     level: str | None = None,
+    source: str | None = None,
+    tiles: Iterable[tuple[str, tuple[float, float, float, float]]] = (),
+    viewport: tuple[float, float, float, float] | None = None,
+    diff: Dict[str, Dict[str, np.ndarray]] | None = None,
+    overlays: Dict[str, np.ndarray] | None = None,
 ):
     """
     Render a page image with highlighted rectangles using Plotly for interactivity.
+
+    - source is a data URI from encode_image; pass it to avoid re-encoding
+      the page image on every call.
+    - tiles are (data URI, clip) pairs drawn over the page image.
+    - viewport is a page region to zoom the axes to.
+    - diff maps levels to DIFF_COLORS kinds to box arrays, drawn over the
+      boxes in the level's legend group, so they are shown and hidden with
+      the level.
+    - overlays maps other levels to their box arrays. They are sent hidden
+      along with rects, and the legend and level buttons show, hide or
+      overlay levels in the browser without a rerun. Hiding and showing
+      persists across figures until level changes.
+
+    Plotly is imported on first use, so worker processes never load it.
     """
-    buf = io.BytesIO()
-    image.save(buf, format="PNG")
-    buf.seek(0)
-    img_bytes = buf.read()
-    img_uri = f"data:image/png;base64,{base64.b64encode(img_bytes).decode('utf-8')}"
+    import plotly.graph_objects as go
+
+    img_uri = source or encode_image(image)
 
     width_px = image.width
     height_px = image.height
@@ -241,22 +1097,54 @@ def render_page_plotly(
         )
     )
 
-    if rects:
-        color = COLORS.get(level or "", (1, 0, 0))
-        fill = f"rgba({int(color[0]*255)},{int(color[1]*255)},{int(color[2]*255)},0.35)"
-        for r in rects:
-            fig.add_shape(
-                type="rect",
-                x0=r.x0,
-                y0=r.y0,
-                x1=r.x1,
-                y1=r.y1,
+    for tile_uri, (x0, y0, x1, y1) in tiles:
+        fig.add_layout_image(
+            dict(
+                source=tile_uri,
                 xref="x",
                 yref="y",
-                line=dict(color="rgba(0,0,0,0)", width=0),
-                fillcolor=fill,
-                opacity=0.6,
+                x=x0,
+                y=y0,
+                sizex=x1 - x0,
+                sizey=y1 - y0,
+                sizing="stretch",
+                xanchor="left",
+                yanchor="top",
+                layer="below",
             )
+        )
+
+    layers = dict(overlays or {})
+    if rects is not None:
+        layers[level or "boxes"] = rects
+    names = [n for n in COLORS if n in layers] + [n for n in layers if n not in COLORS]
+
+    level_traces: dict[str, list[int]] = {}
+    for name in names:
+        boxes = layers[name]
+        if not len(boxes):
+            continue
+        color = COLORS.get(name, (1, 0, 0))
+        fill = f"rgba({int(color[0]*255)},{int(color[1]*255)},{int(color[2]*255)},0.35)"
+        visible = True if rects is not None and name == (level or "boxes") else "legendonly"
+        start = len(fig.data)
+        fig.add_traces(
+            box_traces(boxes, fill, name=name, visible=visible, legend=bool(overlays)),
+        )
+        level_traces[name] = list(range(start, len(fig.data)))
+
+    for name, kinds in (diff or {}).items():
+        visible = True if name == (level or "boxes") else "legendonly"
+        for kind, boxes in kinds.items():
+            if not len(boxes):
+                continue
+            color = DIFF_COLORS[kind]
+            fill = f"rgba({int(color[0]*255)},{int(color[1]*255)},{int(color[2]*255)},0.6)"
+            start = len(fig.data)
+            fig.add_traces(
+                box_traces(boxes, fill, name=f"{kind} {name}", visible=visible, group=name),
+            )
+            level_traces.setdefault(name, []).extend(range(start, len(fig.data)))
 
     fig.update_xaxes(
         range=[0, page_width],
@@ -296,6 +1184,8 @@ def render_page_plotly(
 
     fig.update_layout(
         margin=dict(l=0, r=0, t=0, b=0),
+        showlegend=False,
+        hovermode="closest",
         dragmode="zoom",
         plot_bgcolor="rgba(0,0,0,0)",
         paper_bgcolor="rgba(0,0,0,0)",
@@ -306,4 +1196,54 @@ def render_page_plotly(
         yaxis_range=[page_height, 0],
     )
 
+    if overlays:
+        fig.update_layout(
+            showlegend=True,
+            legend=dict(
+                orientation="h",
+                x=1,
+                y=1,
+                xanchor="right",
+                yanchor="top",
+                bgcolor="rgba(255,255,255,0.7)",
+                uirevision=level,
+            ),
+            updatemenus=[level_menu(level_traces)],
+        )
+
+    if viewport is not None:
+        x0, y0, x1, y1 = viewport
+        fig.update_layout(xaxis_range=[x0, x1], yaxis_range=[y1, y0])
+
     return fig
+
+
+def level_menu(level_traces: dict[str, list[int]]) -> dict:
+    """
+    Plotly buttons that show one level or all levels in the browser.
+    level_traces maps each level to the indices of its traces.
+    """
+    indices = [i for traces in level_traces.values() for i in traces]
+
+    def show(names: list[str]) -> list:
+        visible = [
+            True if name in names else "legendonly"
+            for name, traces in level_traces.items()
+            for _ in traces
+        ]
+        return [{"visible": visible}, indices]
+
+    buttons = [dict(label=name, method="restyle", args=show([name])) for name in level_traces]
+    buttons.append(dict(label="all", method="restyle", args=show(list(level_traces))))
+
+    return dict(
+        type="buttons",
+        direction="right",
+        showactive=False,
+        x=0,
+        y=1,
+        xanchor="left",
+        yanchor="top",
+        bgcolor="rgba(255,255,255,0.7)",
+        buttons=buttons,
+    )
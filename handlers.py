@@ -1,8 +1,41 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Iterable
+import io
+import uuid
+import zipfile
+
 import streamlit as st
 
+import caches
 import core
+import instrument
+import prefetch
+import shared
+import spatial
+import workers
+
+LEVELS = ["blocks", "lines", "spans", "words", "chars"]
+
+EXPORT_LEVELS = LEVELS[:4]  # chars are exported only on request
+
+LOOKAHEAD = 2  # pages rendered ahead of the current page
+
+IMAGE_FORMATS = ["png", "jpeg", "webp"]
+
+IMAGE_QUALITY = 85
+
+RASTER_MODES = list(core.COLORSPACES)
+
+TILE_BASE_DPI = 72  # base image DPI in deep-zoom mode
+
+MAX_TILE_DPI = 1200
+
+FLAG_KEYS = list(core.FLAG_MAP)
 
-LEVELS = ["blocks", "lines", "spans", "words"]
+OCR_MODES = ["off", "auto", "full"]
+
+EXPORT_SCOPES = ["document", "all documents"]
 
 def init_helper_states():
 
@@ -24,11 +57,35 @@ def init_helper_states():
     if "level_select" not in st.session_state:
         st.session_state.level_select = LEVELS[0]
 
-    if "last_flags" not in st.session_state:
-        st.session_state.last_flags = None
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+
+    if "page_status" not in st.session_state:
+        st.session_state.page_status = {}
+
+    if "document_lease" not in st.session_state:
+        st.session_state.document_lease = shared.DOCUMENTS.lease(
+            st.session_state.session_id,
+            partial(prefetch.PREFETCHER.cancel, st.session_state.session_id),
+        )
+
+    if "zoom_region" not in st.session_state:
+        st.session_state.zoom_region = None
 
-    if "last_ocr_mode" not in st.session_state:
-        st.session_state.last_ocr_mode = None
+    if "inspect" not in st.session_state:
+        st.session_state.inspect = None
+
+    if "page_figure" not in st.session_state:
+        st.session_state.page_figure = None
+
+    if "page_comparison" not in st.session_state:
+        st.session_state.page_comparison = None
+
+    if "doc_comparison" not in st.session_state:
+        st.session_state.doc_comparison = None
+
+    if "export" not in st.session_state:
+        st.session_state.export = None
 
 
 def reconcile_docs():
@@ -40,6 +97,7 @@ def reconcile_docs():
         if d["name"] in upload_names
     ]
 
+    release_stale_documents(st.session_state.docs, docs)
     st.session_state.docs = docs
 
     if not docs:
@@ -57,27 +115,52 @@ def reconcile_docs():
     if current_page is None:
         st.session_state.page_index = 0
     else:
-        st.session_state.page_index = max(0, min(current_page, len(docs[idx]["pages"]) - 1))
+        st.session_state.page_index = max(0, min(current_page, docs[idx]["page_count"] - 1))
+
 
+def release_stale_documents(old_docs: list[dict], docs: list[dict]) -> None:
+    """
+    Release removed documents from the shared store; their pages, rects,
+    tiles and indexes are dropped once no other session has them open.
+    """
+    stale = {d["hash"] for d in old_docs} - {d["hash"] for d in docs}
+    if stale:
+        shared.DOCUMENTS.release(st.session_state.session_id, stale)
 
+    figure = st.session_state.get("page_figure")
+    if figure is not None and figure[0][0] in stale:
+        st.session_state.page_figure = None
+
+
+@instrument.timed
 def on_upload():
     uploads = st.session_state.uploads or []
-    
+
     with st.spinner(text="Converting Files...", show_time=True):
-        docs = core.init_docs(uploads, dpi=st.session_state.dpi)
+        docs = core.init_docs(
+            uploads,
+            st.session_state.docs + shared.DOCUMENTS.records(),
+        )
+        docs = shared.DOCUMENTS.acquire(st.session_state.session_id, docs)
+        if st.session_state.get("prerender"):
+            render_all_pages(docs, current_dpi())
 
+    release_stale_documents(st.session_state.docs, docs)
     st.session_state.docs = docs
-    st.session_state.last_flags = None
-    st.session_state.last_ocr_mode = None
-    st.session_state.page_index = 0
 
-    if docs:
-        st.session_state.doc_idx = 0
-        st.session_state.doc_name = docs[0]["name"]
-    else:
+    if not docs:
         st.session_state.doc_idx = None
         st.session_state.doc_name = None
         st.session_state.page_index = None
+        return
+
+    names = [d["name"] for d in docs]
+    if st.session_state.doc_name in names:
+        st.session_state.doc_idx = names.index(st.session_state.doc_name)
+    else:
+        st.session_state.doc_idx = 0
+        st.session_state.doc_name = names[0]
+        st.session_state.page_index = 0
 
 
 def on_doc_change():
@@ -138,7 +221,7 @@ def page_indices():
     doc = current_doc()
     if not doc:
         return []
-    return list(range(len(doc["pages"])))
+    return list(range(doc["page_count"]))
 
 
 def page_prev_disabled() -> bool:
@@ -151,7 +234,7 @@ def page_next_disabled() -> bool:
     doc = current_doc()
     if idx is None or not doc:
         return True
-    return idx >= len(doc["pages"]) - 1
+    return idx >= doc["page_count"] - 1
 
 
 def on_page_prev():
@@ -163,7 +246,7 @@ def on_page_prev():
 def on_page_next():
     idx = st.session_state.page_index
     doc = current_doc()
-    if idx is not None and doc and idx < len(doc["pages"]) - 1:
+    if idx is not None and doc and idx < doc["page_count"] - 1:
         st.session_state.page_index = idx + 1
 
 
@@ -204,125 +287,864 @@ def current_ocr_mode() -> str:
     return st.session_state.get("ocr_mode", "off")
 
 
+def deep_zoom_enabled() -> bool:
+    return bool(st.session_state.get("deep_zoom", False))
+
+
 def current_dpi() -> int:
+    if deep_zoom_enabled():
+        return TILE_BASE_DPI
     return int(st.session_state.get("dpi", 450))
 
 
-def invalidate_boxes_if_needed(flags: int, ocr_mode: str) -> None:
-    if (
-        st.session_state.last_flags == flags
-        and st.session_state.last_ocr_mode == ocr_mode
-    ):
-        return
+def current_lookahead() -> int:
+    return int(st.session_state.get("lookahead", LOOKAHEAD))
 
-    for doc in st.session_state.docs:
-        for page in doc["pages"]:
-            page["blocks"] = None
-            page["lines"] = None
-            page["spans"] = None
-            page["words"] = None
 
-    st.session_state.last_flags = flags
-    st.session_state.last_ocr_mode = ocr_mode
+def current_image_format() -> str:
+    return st.session_state.get("image_format", IMAGE_FORMATS[0])
 
 
-def ensure_boxes_for_doc(doc: dict, flags: int, ocr_mode: str) -> None:
-    for i, page in enumerate(doc["pages"]):
-        if page["blocks"] is not None:
-            continue
+def current_image_quality() -> int:
+    return int(st.session_state.get("image_quality", IMAGE_QUALITY))
+
+
+def current_colorspace() -> str:
+    return st.session_state.get("raster_mode", RASTER_MODES[0])
+
+
+def box_key(doc: dict, page_index: int, flags: int, ocr_mode: str) -> tuple:
+    return (doc["hash"], page_index, flags, ocr_mode)
 
-        textpage = core.get_textpage(
-            pdf_bytes=doc["bytes"],
-            page_index=i,
-            flags=flags,
-            ocr_mode=ocr_mode,
+
+def chars_key(doc: dict, page_index: int, flags: int, ocr_mode: str) -> tuple:
+    return (*box_key(doc, page_index, flags, ocr_mode), "chars")
+
+
+def chars_enabled() -> bool:
+    return st.session_state.get("level_select") == "chars"
+
+
+def render_key(doc: dict, page_index: int, dpi: int, colorspace: str) -> tuple:
+    return ("render", doc["hash"], page_index, dpi, colorspace)
+
+
+def tiles_key(doc: dict, page_index: int, colorspace: str) -> tuple:
+    return ("tiles", doc["hash"], page_index, colorspace)
+
+
+def page_key(doc: dict, page_index: int, dpi: int, colorspace: str) -> tuple:
+    return (doc["hash"], page_index, dpi, colorspace)
+
+
+def page_rects(
+    doc: dict,
+    page_index: int,
+    flags: int,
+    ocr_mode: str,
+    *,
+    chars: bool = False,
+) -> dict | None:
+    return cached_page(
+        shared.BOX_CACHE,
+        st.session_state.page_status,
+        doc,
+        page_index,
+        flags,
+        ocr_mode,
+        chars=chars,
+    )
+
+
+def cached_page(
+    cache: caches.LRUCache,
+    status: dict,
+    doc: dict,
+    page_index: int,
+    flags: int,
+    ocr_mode: str,
+    *,
+    chars: bool = False,
+) -> dict | None:
+    """
+    The rects of a page, with the chars level added when chars is set.
+
+    Characters are cached under their own key, so pages viewed at the other
+    levels never pay for them. A page missing its characters gets every
+    level from one extraction, which fills both keys, so the characters
+    always line up with the spans and an OCR page is recognized once.
+    Returns None for failed pages; if only the characters fail, the page is
+    returned without them.
+    """
+    key = box_key(doc, page_index, flags, ocr_mode)
+    if key in status:
+        return None
+
+    extra = None
+    if chars:
+        extra = cached_rects(
+            cache, status, chars_key(doc, page_index, flags, ocr_mode),
+            partial(extract_with_chars, cache, key, doc, page_index, flags, ocr_mode),
         )
-        rects = core.extract_rects(textpage)
 
-        page["blocks"] = rects["blocks"]
-        page["lines"] = rects["lines"]
-        page["spans"] = rects["spans"]
-        page["words"] = rects["words"]
+    rects = cached_rects(
+        cache, status, key,
+        partial(workers.POOL.extract, doc, page_index, flags, ocr_mode),
+    )
+    if rects is None or extra is None:
+        return rects
+    return {**rects, **extra}
+
+
+def extract_with_chars(
+    cache: caches.LRUCache,
+    key: tuple,
+    doc: dict,
+    page_index: int,
+    flags: int,
+    ocr_mode: str,
+) -> dict:
+    """
+    Extract every level and the chars of a page in one worker task, store
+    the levels under key and return the chars level.
+    """
+    rects = workers.POOL.extract(doc, page_index, flags, ocr_mode, chars=True)
+    extra = {"chars": rects.pop("chars")}
+    cache.put(key, rects)
+    return extra
+
+
+@instrument.timed
+def cached_rects(
+    cache: caches.LRUCache,
+    status: dict,
+    key: tuple,
+    extract: Callable[[], dict],
+) -> dict | None:
+    """
+    Return the rects for key from cache, running extract() in the worker
+    pool on a miss.
+
+    Safe to call from prefetch threads: concurrent calls for one key share
+    a single extraction. Failures are recorded in status under key and are
+    not retried until cleared. Returns None for failed pages.
+    """
+    if key in status:
+        return None
 
+    try:
+        return cache.get_or_compute(key, extract)
+    except workers.PageError as exc:
+        status[key] = str(exc)
+        return None
 
-def warm_boxes(flags: int, ocr_mode: str) -> None:
+
+def prefetch_order(page_count: int, page_index: int) -> list[int]:
+    """
+    Pages other than page_index, nearest first, alternating forward and back.
+    """
+    order = []
+    for distance in range(1, page_count):
+        for i in (page_index + distance, page_index - distance):
+            if 0 <= i < page_count:
+                order.append(i)
+    return order
+
+
+def schedule_prefetch(flags: int, ocr_mode: str) -> None:
+    """
+    Queue background extraction for the pages the user is likely to view
+    next: neighbors of the current page, then the next document.
+    Replaces whatever this session had queued before.
+    """
     doc = current_doc()
-    if not doc:
+    page_index = st.session_state.get("page_index")
+    if doc is None or page_index is None:
+        prefetch.PREFETCHER.cancel(st.session_state.session_id)
         return
 
-    ensure_boxes_for_doc(doc, flags, ocr_mode)
+    targets = [(doc, i) for i in prefetch_order(doc["page_count"], page_index)]
 
     idx = st.session_state.doc_idx
     docs = st.session_state.docs
-    if idx is None:
+    if idx is not None and idx + 1 < len(docs):
+        next_doc = docs[idx + 1]
+        targets += [(next_doc, i) for i in range(next_doc["page_count"])]
+
+    cache = shared.BOX_CACHE
+    status = st.session_state.page_status
+    chars = chars_enabled()
+    jobs = []
+    for target, i in targets:
+        keys = [box_key(target, i, flags, ocr_mode)]
+        if chars:
+            keys.append(chars_key(target, i, flags, ocr_mode))
+        if all(key in cache or key in status for key in keys):
+            continue
+        job = partial(cached_page, cache, status, target, i, flags, ocr_mode, chars=chars)
+        jobs.append((keys[-1], job))
+
+    prefetch.PREFETCHER.schedule(st.session_state.session_id, jobs)
+
+
+def render_pages(doc: dict, dpi: int, colorspace: str, page_indices: list[int]) -> list:
+    """
+    Render pages in the worker pool, recording failures in page_status.
+
+    Returns images in page order, None for pages that failed.
+    """
+    status = st.session_state.page_status
+    results = workers.POOL.render_pages(doc, page_indices, dpi, colorspace=colorspace)
+    images = []
+    for i, result in zip(page_indices, results):
+        if isinstance(result, workers.PageError):
+            status[render_key(doc, i, dpi, colorspace)] = str(result)
+            result = None
+        images.append(result)
+    return images
+
+
+@instrument.timed
+def load_missing_images(doc: dict, page_indices: Iterable[int], dpi: int) -> None:
+    """
+    Put the given pages in the page store, loading those it does not hold
+    from the raster cache or the worker pool.
+    """
+    store = shared.PAGE_STORE
+    status = st.session_state.page_status
+    colorspace = current_colorspace()
+    page_indices = list(page_indices)
+    missing = [
+        i for i in page_indices
+        if page_key(doc, i, dpi, colorspace) not in store
+        and render_key(doc, i, dpi, colorspace) not in status
+    ]
+    for i in page_indices:
+        instrument.cache_access("page images", i not in missing)
+    if not missing:
+        return
+
+    images = core.load_page_images(
+        doc,
+        missing,
+        dpi,
+        render=partial(render_pages, doc, dpi, colorspace),
+        cache=caches.RASTER_CACHE,
+        colorspace=colorspace,
+    )
+    for i, image in zip(missing, images):
+        if image is not None:
+            store.put(page_key(doc, i, dpi, colorspace), {"image": image, "source": None})
+
+
+def page_entry(doc: dict, page_index: int, dpi: int) -> dict | None:
+    """
+    The page store entry for a page, loading the page if it is missing.
+
+    The page and its look-ahead window are loaded together; if the budget
+    is too small to hold them all, the page itself is loaded again.
+    Returns None if the page failed to render.
+    """
+    store = shared.PAGE_STORE
+    key = page_key(doc, page_index, dpi, current_colorspace())
+
+    stop = min(page_index + 1 + current_lookahead(), doc["page_count"])
+    load_missing_images(doc, range(page_index, stop), dpi)
+
+    entry = store.get(key)
+    if entry is None:
+        load_missing_images(doc, [page_index], dpi)
+        entry = store.get(key)
+    return entry
+
+
+def render_all_pages(docs: list[dict], dpi: int) -> None:
+    """
+    Render every page into the raster cache; the page store keeps as many
+    as its budget allows.
+
+    Pages are rendered one pool-sized chunk at a time, so only that many
+    rasters are held outside the page store at once.
+    """
+    chunk = workers.POOL.size
+    for doc in docs:
+        for start in range(0, doc["page_count"], chunk):
+            stop = min(start + chunk, doc["page_count"])
+            load_missing_images(doc, range(start, stop), dpi)
+
+
+@instrument.timed
+def page_source(doc: dict, page_index: int, dpi: int, entry: dict) -> str:
+    fmt = current_image_format()
+    quality = current_image_quality()
+    key = (fmt, quality)
+
+    cached = entry["source"]
+    instrument.cache_access("page sources", cached is not None and cached[0] == key)
+    if cached is None or cached[0] != key:
+        cached = (key, core.encode_image(entry["image"], fmt, quality))
+        # Store a new entry so the page store accounts for the source.
+        shared.PAGE_STORE.put(
+            page_key(doc, page_index, dpi, current_colorspace()),
+            {"image": entry["image"], "source": cached},
+        )
+
+    return cached[1]
+
+
+def selected_levels(points: list) -> list[str]:
+    """
+    The levels of the chart traces the selected points belong to, which
+    are the levels shown in the browser.
+    """
+    memo = st.session_state.get("page_figure")
+    if memo is None:
+        return []
+
+    data = memo[1].data
+    groups = {
+        data[point["curve_number"]].legendgroup
+        for point in points
+        if 0 <= point.get("curve_number", -1) < len(data)
+    }
+    return [level for level in LEVELS if level in groups]
+
+
+def on_page_select():
+    """
+    Box selection zooms in deep-zoom mode and inspects the boxes in the
+    region otherwise, at the levels shown on the chart; clicking a box
+    inspects the boxes under the point.
+    """
+    event = st.session_state.get("page_chart")
+    doc = current_doc()
+    if not event or doc is None:
         return
 
-    next_idx = idx + 1
-    if 0 <= next_idx < len(docs):
-        ensure_boxes_for_doc(docs[next_idx], flags, ocr_mode)
+    target = (doc["hash"], st.session_state.page_index)
+    boxes = event.selection.box
+    points = event.selection.points
+
+    if boxes:
+        x0, x1 = sorted(boxes[-1]["x"])
+        y0, y1 = sorted(boxes[-1]["y"])
+        if x1 - x0 <= 0 or y1 - y0 <= 0:
+            return
+
+        if deep_zoom_enabled():
+            st.session_state.zoom_region = (*target, (x0, y0, x1, y1))
+        else:
+            levels = selected_levels(points)
+            st.session_state.inspect = (*target, "region", (x0, y0, x1, y1), levels)
+
+    elif points:
+        point = points[-1]
+        st.session_state.inspect = (*target, "point", (point["x"], point["y"]), [])
+
 
+def on_zoom_reset():
+    st.session_state.zoom_region = None
 
-def current_page_figure(flags: int, ocr_mode: str, dpi: int):
+
+def current_zoom_region():
+    doc = current_doc()
+    region = st.session_state.get("zoom_region")
+    if not deep_zoom_enabled() or doc is None or region is None:
+        return None
+
+    doc_hash, page_index, rect = region
+    if doc_hash != doc["hash"] or page_index != st.session_state.page_index:
+        return None
+    return rect
+
+
+@instrument.timed
+def page_tile_sources(
+    doc: dict,
+    page_index: int,
+    page_size: tuple[float, float],
+    region: tuple,
+) -> list:
+    """
+    The deep-zoom tiles covering region. Missing tiles are rendered across
+    the worker pool and encoded in parallel, one thread per worker.
+
+    Tile failures are recorded in page_status for the page, and missing
+    tiles are not rendered again until the page is retried.
+    """
+    dpi = core.tile_dpi(page_size[0], region[2] - region[0], TILE_BASE_DPI, MAX_TILE_DPI)
+    if dpi is None:
+        return []
+
+    fmt = current_image_format()
+    quality = current_image_quality()
+    colorspace = current_colorspace()
+    cache = shared.TILE_CACHE
+    status = st.session_state.page_status
+    failed_key = tiles_key(doc, page_index, colorspace)
+
+    tiles = []
+    missing = []
+    for col, row, clip in core.page_tiles(page_size, region, dpi):
+        key = (doc["hash"], page_index, dpi, colorspace, col, row, fmt, quality)
+        uri = cache.get(key)
+        if uri is not None:
+            tiles.append((uri, clip))
+        elif failed_key not in status:
+            missing.append((key, clip))
+
+    if not missing:
+        return tiles
+
+    def render_tile(key: tuple, clip: tuple) -> str | workers.PageError:
+        try:
+            image = workers.POOL.render(doc, page_index, dpi, clip=clip, colorspace=colorspace)
+        except workers.PageError as exc:
+            return exc
+        uri = core.encode_image(image, fmt, quality)
+        cache.put(key, uri)
+        return uri
+
+    with ThreadPoolExecutor(max_workers=min(workers.POOL.size, len(missing))) as ex:
+        results = list(ex.map(render_tile, *zip(*missing)))
+
+    for (_, clip), result in zip(missing, results):
+        if isinstance(result, workers.PageError):
+            status[failed_key] = f"zoom tiles {result}"
+        else:
+            tiles.append((result, clip))
+
+    return tiles
+
+
+def page_status_keys(doc: dict, page_index: int) -> list[tuple]:
+    keys = [
+        render_key(doc, page_index, current_dpi(), current_colorspace()),
+        box_key(doc, page_index, current_flags(), current_ocr_mode()),
+    ]
+    if deep_zoom_enabled():
+        keys.append(tiles_key(doc, page_index, current_colorspace()))
+    if chars_enabled():
+        keys.append(chars_key(doc, page_index, current_flags(), current_ocr_mode()))
+    return keys
+
+
+def current_page_status() -> list[str]:
+    """
+    Failure messages for the current page under the current settings.
+    """
+    doc = current_doc()
+    page_index = st.session_state.get("page_index")
+    if doc is None or page_index is None:
+        return []
+
+    status = st.session_state.page_status
+    return [status[k] for k in page_status_keys(doc, page_index) if k in status]
+
+
+def on_page_retry():
     doc = current_doc()
     page_index = st.session_state.get("page_index")
     if doc is None or page_index is None:
+        return
+
+    for key in page_status_keys(doc, page_index):
+        st.session_state.page_status.pop(key, None)
+
+
+def page_label(page_index: int) -> str:
+    doc = current_doc()
+    status = st.session_state.page_status
+    if doc is not None and any(k in status for k in page_status_keys(doc, page_index)):
+        return f"{page_index} (failed)"
+    return str(page_index)
+
+
+@instrument.timed
+def page_spatial_index(
+    doc: dict,
+    page_index: int,
+    flags: int,
+    ocr_mode: str,
+    level: str,
+    rects: dict,
+) -> spatial.GridIndex:
+    key = (*box_key(doc, page_index, flags, ocr_mode), level)
+    return shared.INDEX_CACHE.get_or_compute(
+        key,
+        lambda: spatial.GridIndex(rects[level]["bbox"]),
+    )
+
+
+def box_rows(rects: dict, level: str, rows) -> list[dict]:
+    """
+    Inspection table rows for boxes of a level: text, bbox, parent rows,
+    font attributes for spans, and code point and origin for chars.
+    """
+    table = rects[level]
+    texts = core.rects_text(rects, level, rows)
+    out = []
+    for row, text in zip(rows, texts):
+        x0, y0, x1, y1 = (round(float(v), 2) for v in table["bbox"][row])
+        item = {"level": level, "row": int(row), "text": text}
+        if level == "spans":
+            item["font"] = str(table["font"][row])
+            item["size"] = round(float(table["size"][row]), 2)
+            item["flags"] = core.span_flag_names(int(table["flags"][row]))
+        if level == "chars":
+            span = int(table["span"][row])
+            item["codepoint"] = f"U+{int(table['codepoint'][row]):04X}"
+            item["origin"] = ", ".join(f"{v:.2f}" for v in table["origin"][row].tolist())
+            item["span"] = span
+            item["line"] = int(rects["spans"]["line"][span])
+            item["block"] = int(rects["spans"]["block"][span])
+        for parent in ("line", "block"):
+            if parent in table:
+                item[parent] = int(table[parent][row])
+        item.update(x0=x0, y0=y0, x1=x1, y1=y1)
+        out.append(item)
+    return out
+
+
+def point_hierarchy(
+    doc: dict,
+    page_index: int,
+    flags: int,
+    ocr_mode: str,
+    rects: dict,
+    x: float,
+    y: float,
+) -> list[dict]:
+    """
+    The block, line, span, word and, when rects has them, character under
+    a point, outermost first.
+
+    The character, span and word are the smallest boxes containing the
+    point; the span is the character's parent if there is one, and the
+    line and block are the span's parents, or the smallest containing
+    boxes when no span contains the point.
+    """
+    def hit(level: str) -> int | None:
+        index = page_spatial_index(doc, page_index, flags, ocr_mode, level, rects)
+        rows = index.query_point(x, y)
+        return int(rows[0]) if len(rows) else None
+
+    char = hit("chars") if "chars" in rects else None
+    span = int(rects["chars"]["span"][char]) if char is not None else hit("spans")
+    if span is not None:
+        line = int(rects["spans"]["line"][span])
+        block = int(rects["spans"]["block"][span])
+    else:
+        line = hit("lines")
+        block = hit("blocks")
+
+    found = {
+        "blocks": block,
+        "lines": line,
+        "spans": span,
+        "words": hit("words"),
+        "chars": char,
+    }
+    rows = []
+    for level, row in found.items():
+        if row is not None:
+            rows += box_rows(rects, level, [row])
+    return rows
+
+
+@instrument.timed
+def current_inspection() -> list[dict]:
+    """
+    Inspection rows for the last click or box selection on the page on
+    screen: the hierarchy under a clicked point, or every box in a selected
+    region at the levels shown on the chart (the selected level if the
+    region holds no boxes).
+    """
+    doc = current_doc()
+    page_index = st.session_state.get("page_index")
+    inspect = st.session_state.get("inspect")
+    level = st.session_state.get("level_select")
+    if doc is None or inspect is None or level not in LEVELS:
+        return []
+
+    doc_hash, inspect_page, kind, coords, levels = inspect
+    if doc_hash != doc["hash"] or inspect_page != page_index:
+        return []
+
+    levels = levels or [level]
+    flags = current_flags()
+    ocr_mode = current_ocr_mode()
+    rects = page_rects(doc, page_index, flags, ocr_mode, chars="chars" in levels + [level])
+    if rects is None:
+        return []
+
+    if kind == "point":
+        return point_hierarchy(doc, page_index, flags, ocr_mode, rects, *coords)
+
+    rows = []
+    for name in levels:
+        if name in rects:
+            index = page_spatial_index(doc, page_index, flags, ocr_mode, name, rects)
+            rows += box_rows(rects, name, index.query_region(*coords))
+    return rows
+
+
+def on_inspect_clear():
+    st.session_state.inspect = None
+
+
+def current_export_levels() -> list[str]:
+    levels = st.session_state.get("export_levels") or []
+    return [level for level in LEVELS if level in levels]
+
+
+def export_docs() -> list[dict]:
+    if st.session_state.get("export_scope") == EXPORT_SCOPES[1]:
+        return st.session_state.docs
+    doc = current_doc()
+    return [doc] if doc is not None else []
+
+
+def export_key(flags: int, ocr_mode: str) -> tuple:
+    return (
+        tuple(d["hash"] for d in export_docs()),
+        flags,
+        ocr_mode,
+        tuple(current_export_levels()),
+        bool(st.session_state.get("export_layers", True)),
+    )
+
+
+def export_document(
+    status: dict,
+    doc: dict,
+    flags: int,
+    ocr_mode: str,
+    levels: list[str],
+    layers: bool,
+) -> bytes:
+    """
+    The document with its boxes drawn on every page. Pages are extracted
+    across the worker pool and drawn in order as they complete; failed
+    pages are copied without boxes.
+    """
+    def rects(page_index: int) -> dict | None:
+        return cached_page(
+            shared.BOX_CACHE, status, doc, page_index, flags, ocr_mode,
+            chars="chars" in levels,
+        )
+
+    with ThreadPoolExecutor(max_workers=workers.POOL.size) as ex:
+        pages = range(doc["page_count"])
+        return core.annotate_document(
+            doc["bytes"], zip(pages, ex.map(rects, pages)), levels, layers=layers,
+        )
+
+
+def annotated_name(name: str) -> str:
+    stem = name[:-4] if name.lower().endswith(".pdf") else name
+    return f"{stem}.annotated.pdf"
+
+
+@instrument.timed
+def on_export():
+    """
+    Write the selected documents with the boxes of the export levels drawn
+    in, as one PDF or a zip of PDFs, ready for download.
+    """
+    docs = export_docs()
+    levels = current_export_levels()
+    if not docs or not levels:
+        return
+
+    flags = current_flags()
+    ocr_mode = current_ocr_mode()
+    layers = bool(st.session_state.get("export_layers", True))
+    status = st.session_state.page_status
+
+    with st.spinner(text="Exporting...", show_time=True):
+        files = [
+            (annotated_name(d["name"]), export_document(status, d, flags, ocr_mode, levels, layers))
+            for d in docs
+        ]
+
+    failed = sum(
+        box_key(d, i, flags, ocr_mode) in status
+        for d in docs
+        for i in range(d["page_count"])
+    )
+
+    if len(files) == 1:
+        name, data = files[0]
+        mime = "application/pdf"
+    else:
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+            for file_name, pdf_bytes in files:
+                zf.writestr(file_name, pdf_bytes)
+        name, data, mime = "annotated.zip", buf.getvalue(), "application/zip"
+
+    st.session_state.export = (export_key(flags, ocr_mode), name, data, mime, failed)
+
+
+def current_export() -> tuple | None:
+    """
+    (file name, data, mime type, failed page count) of the last export, or
+    None if it was made for other documents or settings.
+    """
+    memo = st.session_state.get("export")
+    if memo is None or memo[0] != export_key(current_flags(), current_ocr_mode()):
+        return None
+    return memo[1:]
+
+
+def level_overlays(rects: dict | None, level: str) -> dict | None:
+    """
+    Boxes of the levels other than level, sent with the figure so the
+    browser can switch or overlay levels without a rerun.
+    """
+    if rects is None:
         return None
+    return {name: rects[name]["bbox"] for name in LEVELS if name != level and name in rects}
+
 
-    invalidate_boxes_if_needed(flags, ocr_mode)
-    warm_boxes(flags, ocr_mode)
+def diff_fingerprint(diff: dict | None) -> tuple | None:
+    if diff is None:
+        return None
+    return tuple(
+        (level, kind, boxes.tobytes())
+        for level, kinds in diff.items()
+        for kind, boxes in kinds.items()
+    )
+
+
+@instrument.timed
+def current_page_figure(flags: int, ocr_mode: str, dpi: int, *, diff: dict | None = None):
+    """
+    The Plotly figure of the page on screen, with diff boxes (by level and
+    DIFF_COLORS kind) drawn over the boxes.
+
+    The figure is kept while only the selected level changes (other than
+    to or from chars, which adds or drops the chars boxes). Streamlit then
+    sends the browser a reference to the chart it already has instead of
+    the page image again, and the level buttons on the chart switch levels.
+    """
+    doc = current_doc()
+    page_index = st.session_state.get("page_index")
+    if doc is None or page_index is None:
+        return None
 
-    if page_index < 0 or page_index >= len(doc["pages"]):
+    if page_index < 0 or page_index >= doc["page_count"]:
         return None
 
-    page = doc["pages"][page_index]
+    entry = page_entry(doc, page_index, dpi)
     level = st.session_state.get("level_select")
-    if level not in page:
+    if level not in LEVELS or entry is None:
         return None
 
-    rects = page[level]
-    fig = core.render_page_plotly(page["image"], rects, dpi, level=level)
+    chars = level == "chars"
+    rects = page_rects(doc, page_index, flags, ocr_mode, chars=chars)
+    schedule_prefetch(flags, ocr_mode)
+
+    image = entry["image"]
+    page_size = (image.width * 72 / dpi, image.height * 72 / dpi)
+    region = current_zoom_region()
+    tiles = page_tile_sources(doc, page_index, page_size, region) if region else []
+    source = page_source(doc, page_index, dpi, entry)
+
+    key = (
+        *box_key(doc, page_index, flags, ocr_mode),
+        chars,
+        rects is None,
+        dpi,
+        source,
+        tuple(tiles),
+        region,
+        deep_zoom_enabled(),
+        diff_fingerprint(diff),
+    )
+    memo = st.session_state.page_figure
+    instrument.cache_access("page figures", memo is not None and memo[0] == key)
+    if memo is not None and memo[0] == key:
+        return memo[1]
+
+    fig = core.render_page_plotly(
+        image,
+        rects[level]["bbox"] if rects is not None and level in rects else None,
+        dpi,
+        level=level,
+        source=source,
+        tiles=tiles,
+        viewport=region,
+        diff=diff,
+        overlays=level_overlays(rects, level),
+    )
+    if deep_zoom_enabled():
+        fig.update_layout(dragmode="select")
+
+    st.session_state.page_figure = (key, fig)
     return fig
 
 
+@instrument.timed
 def on_dpi_change():
-    uploads = st.session_state.get("uploads") or []
-    dpi = st.session_state.get("dpi", 450)
+    """
+    Pre-render every page at the new DPI or color mode, if enabled.
 
-    st.session_state.last_flags = None
-    st.session_state.last_ocr_mode = None
+    Page store entries are keyed by DPI and color mode, so images at the
+    previous settings stay until evicted and switching back is instant.
+    Extraction results are in page points and stay cached.
+    """
+    docs = st.session_state.docs
+    if st.session_state.get("prerender"):
+        dpi = current_dpi()
+        with st.spinner(text=f"Re-rendering at {dpi} DPI...", show_time=True):
+            render_all_pages(docs, dpi)
 
-    if not uploads:
-        st.session_state.docs = []
-        st.session_state.doc_idx = None
-        st.session_state.doc_name = None
-        st.session_state.page_index = None
-        return
 
-    current_name = st.session_state.doc_name
-    current_page = st.session_state.get("page_index")
+def instrumentation_enabled() -> bool:
+    return instrument.enabled()
 
-    with st.spinner(text=f"Re-rendering at {dpi} DPI...", show_time=True):
-        docs = core.init_docs(uploads, dpi=dpi)
 
-    st.session_state.docs = docs
+def on_instrument_change():
+    instrument.set_enabled(st.session_state.instrument)
+
+
+def stage_span(name: str):
+    return instrument.span(name)
+
+
+def on_instrument_reset():
+    instrument.RECORDER.reset()
+
+
+def stage_stats() -> list[dict]:
+    return instrument.RECORDER.stage_rows()
+
+
+def cache_stats() -> list[dict]:
+    return instrument.RECORDER.cache_rows()
 
-    if not docs:
-        st.session_state.doc_idx = None
-        st.session_state.doc_name = None
-        st.session_state.page_index = None
-        return
 
-    target_idx = 0
-    if current_name:
-        for i, d in enumerate(docs):
-            if d["name"] == current_name:
-                target_idx = i
-                break
+def memory_stats() -> list[dict]:
+    """
+    Memory held by the process for all sessions: the bytes of open
+    documents and the shared caches.
+    """
+    documents = shared.DOCUMENTS.stats()
+    rows = [{
+        "item": f"pdf bytes ({documents['owners']} sessions)",
+        "entries": documents["documents"],
+        "MB": round(documents["nbytes"] / 2**20, 2),
+    }]
+    for name, cache in shared.CACHES.items():
+        rows.append({"item": name, "entries": len(cache), "MB": round(cache.nbytes / 2**20, 2)})
+    return rows
 
-    st.session_state.doc_idx = target_idx
-    st.session_state.doc_name = docs[target_idx]["name"]
 
-    page_index = current_page if current_page is not None else 0
-    max_page = len(docs[target_idx]["pages"])
-    page_index = min(page_index, max_page - 1)
-    st.session_state.page_index = max(page_index, 0)
+def trace_file() -> bytes:
+    """
+    The recorded stages as a Chrome trace; passed to the download button
+    uncalled, so the trace is only built when it is downloaded.
+    """
+    return instrument.RECORDER.chrome_trace()
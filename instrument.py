@@ -0,0 +1,165 @@
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Iterator
+import functools
+import json
+import os
+import threading
+import time
+
+ENABLED = os.environ.get("PDF_INSPECTOR_INSTRUMENT", "") not in ("", "0")
+
+TRACE_EVENTS = 100_000  # most recent stage calls kept for the trace export
+
+
+class Recorder:
+    """
+    Process-wide record of stage timings and cache accesses.
+
+    - Per stage: call count, total and maximum wall time.
+    - Per cache: hits and misses.
+    - The most recent max_events calls as Chrome trace "complete" events,
+      one track per thread.
+    """
+
+    def __init__(self, max_events: int = TRACE_EVENTS):
+        self._lock = threading.Lock()
+        self._stages: dict[str, list[int]] = {}
+        self._caches: dict[str, list[int]] = {}
+        self._events: deque[dict] = deque(maxlen=max_events)
+        self._origin = time.perf_counter_ns()
+
+    def record(self, name: str, start_ns: int, end_ns: int) -> None:
+        duration = end_ns - start_ns
+        event = {
+            "name": name,
+            "cat": name.split(".", 1)[0],
+            "ph": "X",
+            "ts": (start_ns - self._origin) / 1000,
+            "dur": duration / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+        }
+
+        with self._lock:
+            stats = self._stages.setdefault(name, [0, 0, 0])
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = max(stats[2], duration)
+            self._events.append(event)
+
+    def cache_access(self, name: str, hit: bool) -> None:
+        with self._lock:
+            stats = self._caches.setdefault(name, [0, 0])
+            stats[0 if hit else 1] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages.clear()
+            self._caches.clear()
+            self._events.clear()
+            self._origin = time.perf_counter_ns()
+
+    def stage_rows(self) -> list[dict]:
+        with self._lock:
+            items = sorted(self._stages.items(), key=lambda item: -item[1][1])
+        return [
+            {
+                "stage": name,
+                "calls": calls,
+                "total ms": round(total / 1e6, 2),
+                "mean ms": round(total / calls / 1e6, 3),
+                "max ms": round(longest / 1e6, 2),
+            }
+            for name, (calls, total, longest) in items
+        ]
+
+    def cache_rows(self) -> list[dict]:
+        with self._lock:
+            items = sorted(self._caches.items())
+        return [
+            {
+                "cache": name,
+                "hits": hits,
+                "misses": misses,
+                "hit rate": round(hits / (hits + misses), 3) if hits + misses else None,
+            }
+            for name, (hits, misses) in items
+        ]
+
+    def chrome_trace(self) -> bytes:
+        """
+        The recorded calls as a Chrome trace JSON file, for chrome://tracing
+        or Perfetto.
+        """
+        with self._lock:
+            events = list(self._events)
+
+        names = {
+            "name": "thread_name",
+            "ph": "M",
+            "pid": os.getpid(),
+        }
+        threads = {t.ident: t.name for t in threading.enumerate()}
+        metadata = [
+            {**names, "tid": tid, "args": {"name": threads.get(tid, str(tid))}}
+            for tid in {e["tid"] for e in events}
+        ]
+
+        return json.dumps(
+            {"traceEvents": metadata + events, "displayTimeUnit": "ms"},
+        ).encode("utf-8")
+
+
+RECORDER = Recorder()
+
+
+def enabled() -> bool:
+    return ENABLED
+
+
+def set_enabled(on: bool) -> None:
+    global ENABLED
+    ENABLED = bool(on)
+
+
+def timed(fn: Callable) -> Callable:
+    """
+    Record each call of fn as a stage named "module.function" while
+    instrumentation is enabled. Disabled, the wrapper only checks a flag.
+    """
+    name = f"{fn.__module__}.{fn.__qualname__}"
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return fn(*args, **kwargs)
+
+        start = time.perf_counter_ns()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            RECORDER.record(name, start, time.perf_counter_ns())
+
+    return wrapper
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """
+    Record the enclosed block as a stage while instrumentation is enabled.
+    """
+    if not ENABLED:
+        yield
+        return
+
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        RECORDER.record(name, start, time.perf_counter_ns())
+
+
+def cache_access(name: str, hit: bool) -> None:
+    if ENABLED:
+        RECORDER.cache_access(name, hit)
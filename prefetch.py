@@ -0,0 +1,85 @@
+from collections import OrderedDict
+from typing import Callable, Hashable
+import logging
+import threading
+
+import workers
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """
+    Background threads that run prefetch jobs for many owners.
+
+    - Each owner (a browser session) has one queue of (key, job) pairs in
+      priority order.
+    - schedule() replaces the owner's pending jobs, so navigating or
+      changing settings cancels and reprioritizes work in one call.
+    - Owners are served round-robin by a fixed number of threads.
+    - Jobs run in the background lane of pool, which keeps a worker free
+      for the page on screen.
+    """
+
+    def __init__(self, pool: workers.WorkerPool, threads: int = 1):
+        self.pool = pool
+        self.threads = max(1, threads)
+        self._cond = threading.Condition()
+        self._queues: OrderedDict[Hashable, list[tuple[Hashable, Callable[[], None]]]] = OrderedDict()
+        self._started = False
+
+    def schedule(
+        self,
+        owner: Hashable,
+        jobs: list[tuple[Hashable, Callable[[], None]]],
+    ) -> None:
+        with self._cond:
+            if jobs:
+                self._queues[owner] = list(jobs)
+            else:
+                self._queues.pop(owner, None)
+
+            if not self._started:
+                self._started = True
+                for i in range(self.threads):
+                    threading.Thread(
+                        target=self._run,
+                        name=f"prefetch-{i}",
+                        daemon=True,
+                    ).start()
+
+            self._cond.notify_all()
+
+    def cancel(self, owner: Hashable) -> None:
+        with self._cond:
+            self._queues.pop(owner, None)
+
+    def pending(self, owner: Hashable) -> int:
+        with self._cond:
+            return len(self._queues.get(owner, ()))
+
+    def _next_job(self) -> tuple[Hashable, Callable[[], None]]:
+        with self._cond:
+            while not self._queues:
+                self._cond.wait()
+
+            owner, queue = next(iter(self._queues.items()))
+            key, job = queue.pop(0)
+            if queue:
+                self._queues.move_to_end(owner)
+            else:
+                del self._queues[owner]
+
+            return key, job
+
+    def _run(self) -> None:
+        while True:
+            key, job = self._next_job()
+            try:
+                with self.pool.background():
+                    job()
+            except Exception:
+                logger.exception("Prefetch job %r failed", key)
+
+
+PREFETCHER = Prefetcher(workers.POOL, threads=workers.POOL.background_limit)
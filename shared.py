@@ -0,0 +1,164 @@
+from typing import Callable, Iterable
+import queue
+import threading
+import weakref
+
+import caches
+import core
+import workers
+
+
+class DocumentStore:
+    """
+    Process-wide registry of open documents, shared by content hash.
+
+    - Each owner (a session) acquires the documents it has open; a document
+      uploaded by several owners keeps one copy of its bytes.
+    - An owner releases documents it closes, and all of its documents when
+      its lease is garbage collected. Collection only queues the owner; the
+      release runs on the next call into the store, since garbage collection
+      can run in a thread that holds the locks the release takes.
+    - When the last owner of a document releases it, on_release is called
+      with its hash so shared caches and workers can drop it.
+    """
+
+    def __init__(self, on_release: Callable[[set[str]], None]):
+        self.on_release = on_release
+        self._lock = threading.Lock()
+        self._docs: dict[str, dict] = {}
+        self._owners: dict[str, set[str]] = {}
+        self._closed: queue.SimpleQueue = queue.SimpleQueue()
+
+    def records(self) -> list[dict]:
+        self.collect()
+        with self._lock:
+            return list(self._docs.values())
+
+    def acquire(self, owner: str, docs: list[dict]) -> list[dict]:
+        """
+        Register docs for owner and return them with their bytes replaced
+        by the shared copy where another owner holds the same content.
+        """
+        self.collect()
+        out = []
+        with self._lock:
+            for doc in docs:
+                shared = self._docs.setdefault(doc["hash"], doc)
+                self._owners.setdefault(doc["hash"], set()).add(owner)
+                if shared["bytes"] is not doc["bytes"]:
+                    doc = {**doc, "bytes": shared["bytes"]}
+                out.append(doc)
+        return out
+
+    def release(self, owner: str, hashes: Iterable[str]) -> None:
+        self.collect()
+        self._release(owner, hashes)
+
+    def _release(self, owner: str, hashes: Iterable[str]) -> None:
+        unused = set()
+        with self._lock:
+            for h in hashes:
+                owners = self._owners.get(h)
+                if owners is None:
+                    continue
+                owners.discard(owner)
+                if not owners:
+                    del self._owners[h]
+                    del self._docs[h]
+                    unused.add(h)
+
+        if unused:
+            self.on_release(unused)
+
+    def release_owner(self, owner: str) -> None:
+        self.collect()
+        self._release_owner(owner)
+
+    def _release_owner(self, owner: str) -> None:
+        with self._lock:
+            hashes = [h for h, owners in self._owners.items() if owner in owners]
+        self._release(owner, hashes)
+
+    def lease(self, owner: str, on_close: Callable[[], None] | None = None) -> object:
+        """
+        A token to keep in the owner's state: once it is garbage collected,
+        on_close runs and the owner's documents are released by the next
+        call into the store.
+        """
+        token = type("Lease", (), {"owner": owner})()
+
+        # SimpleQueue.put is safe to call from a finalizer. Not at
+        # interpreter exit: the worker pool may already be shut down.
+        weakref.finalize(token, self._closed.put, (owner, on_close)).atexit = False
+        return token
+
+    def collect(self) -> None:
+        """
+        Close the owners whose leases were garbage collected.
+        """
+        while True:
+            try:
+                owner, on_close = self._closed.get_nowait()
+            except queue.Empty:
+                return
+
+            if on_close is not None:
+                on_close()
+            self._release_owner(owner)
+
+    def stats(self) -> dict:
+        self.collect()
+        with self._lock:
+            return {
+                "documents": len(self._docs),
+                "owners": len({o for owners in self._owners.values() for o in owners}),
+                "nbytes": sum(len(d["bytes"]) for d in self._docs.values()),
+            }
+
+
+def page_nbytes(entry: dict) -> int:
+    image = entry["image"]
+    source = entry["source"]
+    size = image.width * image.height * len(image.getbands())
+    return size + (len(source[1]) if source is not None else 0)
+
+
+# Keyed by (hash, page, dpi, colorspace).
+PAGE_STORE = caches.LRUCache(caches.PAGE_CACHE_MB * 1024 * 1024, page_nbytes)
+
+# Keyed by (hash, page, flags, ocr_mode).
+BOX_CACHE = caches.LRUCache(
+    caches.BOX_CACHE_MB * 1024 * 1024,
+    core.rects_nbytes,
+    name="boxes",
+)
+
+# Keyed by (hash, page, dpi, colorspace, col, row, format, quality).
+TILE_CACHE = caches.LRUCache(caches.TILE_CACHE_MB * 1024 * 1024, len, name="tiles")
+
+# Keyed by (hash, page, flags, ocr_mode, level).
+INDEX_CACHE = caches.LRUCache(
+    caches.INDEX_CACHE_MB * 1024 * 1024,
+    lambda index: index.nbytes,
+    name="spatial index",
+)
+
+CACHES = {
+    "page store": PAGE_STORE,
+    "box cache": BOX_CACHE,
+    "tile cache": TILE_CACHE,
+    "index cache": INDEX_CACHE,
+}
+
+
+def release_documents(hashes: set[str]) -> None:
+    """
+    Close documents no session uses in the workers and drop their pages,
+    rects, tiles and indexes from the shared caches.
+    """
+    workers.POOL.release(hashes)
+    for cache in CACHES.values():
+        cache.remove_if(lambda key: key[0] in hashes)
+
+
+DOCUMENTS = DocumentStore(release_documents)
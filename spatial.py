@@ -0,0 +1,116 @@
+import numpy as np
+
+MAX_CELLS_PER_BOX = 4  # bound on grid size relative to the number of boxes
+
+
+class GridIndex:
+    """
+    Uniform grid over an N×4 box array for point and region queries.
+
+    - Cells are sized from the median box, so each holds a few boxes.
+    - Cell contents are CSR arrays: the rows in cell c are
+      items[starts[c]:starts[c + 1]], with cells numbered row by row.
+    - A box spanning several cells is listed in each of them.
+    """
+
+    def __init__(self, boxes: np.ndarray):
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        n = len(self.boxes)
+
+        if n:
+            self.origin = self.boxes[:, :2].min(axis=0)
+            extent = np.maximum(self.boxes[:, 2:].max(axis=0) - self.origin, 1.0)
+            sizes = np.maximum(
+                self.boxes[:, 2] - self.boxes[:, 0],
+                self.boxes[:, 3] - self.boxes[:, 1],
+            )
+            cell = max(float(np.median(sizes)), 1.0)
+        else:
+            self.origin = np.zeros(2, dtype=np.float32)
+            extent = np.ones(2, dtype=np.float32)
+            cell = 1.0
+
+        # Grow cells until the grid has at most MAX_CELLS_PER_BOX cells per box.
+        cells = np.prod(np.ceil(extent / cell))
+        limit = max(1, n * MAX_CELLS_PER_BOX)
+        if cells > limit:
+            cell *= float(np.sqrt(cells / limit))
+
+        self.cell = cell
+        self.cols, self.rows = (int(v) for v in np.ceil(extent / cell) + 1)
+
+        cx0, cy0 = self._cells(self.boxes[:, 0], self.boxes[:, 1])
+        cx1, cy1 = self._cells(self.boxes[:, 2], self.boxes[:, 3])
+        widths = cx1 - cx0 + 1
+        counts = widths * (cy1 - cy0 + 1)
+
+        rows = np.repeat(np.arange(n, dtype=np.int32), counts)
+        k = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        cell_ids = (cy0[rows] + k // widths[rows]) * self.cols + cx0[rows] + k % widths[rows]
+
+        order = np.argsort(cell_ids, kind="stable")
+        self.items = rows[order]
+        self.starts = np.searchsorted(
+            cell_ids[order],
+            np.arange(self.cols * self.rows + 1),
+        )
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.boxes.nbytes + self.items.nbytes + self.starts.nbytes
+
+    def _cells(self, x, y) -> tuple[np.ndarray, np.ndarray]:
+        cx = np.floor((np.asarray(x) - self.origin[0]) / self.cell).astype(np.int64)
+        cy = np.floor((np.asarray(y) - self.origin[1]) / self.cell).astype(np.int64)
+        return np.clip(cx, 0, self.cols - 1), np.clip(cy, 0, self.rows - 1)
+
+    def _candidates(self, x0: float, y0: float, x1: float, y1: float) -> np.ndarray:
+        cx0, cy0 = self._cells(x0, y0)
+        cx1, cy1 = self._cells(x1, y1)
+
+        # Cells of one grid row are contiguous, so each row is one slice.
+        parts = [
+            self.items[self.starts[cy * self.cols + cx0]:self.starts[cy * self.cols + cx1 + 1]]
+            for cy in range(int(cy0), int(cy1) + 1)
+        ]
+        if not parts:
+            return np.zeros(0, dtype=np.int32)
+        return np.unique(np.concatenate(parts))
+
+    def query_point(self, x: float, y: float) -> np.ndarray:
+        """
+        Rows of the boxes containing (x, y), smallest box first.
+        """
+        rows = self._candidates(x, y, x, y)
+        b = self.boxes[rows]
+        rows = rows[(b[:, 0] <= x) & (x <= b[:, 2]) & (b[:, 1] <= y) & (y <= b[:, 3])]
+
+        b = self.boxes[rows]
+        area = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+        return rows[np.argsort(area, kind="stable")]
+
+    def query_region(
+        self,
+        x0: float,
+        y0: float,
+        x1: float,
+        y1: float,
+        *,
+        contained: bool = False,
+    ) -> np.ndarray:
+        """
+        Rows of the boxes intersecting the region, or only those inside it
+        when contained is set, in row order.
+        """
+        rows = self._candidates(x0, y0, x1, y1)
+        b = self.boxes[rows]
+
+        if contained:
+            hit = (b[:, 0] >= x0) & (b[:, 2] <= x1) & (b[:, 1] >= y0) & (b[:, 3] <= y1)
+        else:
+            hit = (b[:, 0] <= x1) & (b[:, 2] >= x0) & (b[:, 1] <= y1) & (b[:, 3] >= y0)
+
+        return rows[hit]
@@ -0,0 +1,97 @@
+import threading
+
+import numpy as np
+import pymupdf
+from PIL import Image
+
+import caches
+import core
+
+
+def disk_size(cache: caches.DiskCache) -> int:
+    return sum(st.st_size for _, st in cache._entries())
+
+
+def test_disk_cache_overwrite_is_counted_once(tmp_path):
+    cache = caches.DiskCache(str(tmp_path), 1 << 20)
+    cache.put("aa-key", b"x" * 100)
+    cache.put("aa-key", b"y" * 40)
+
+    assert cache.get("aa-key") == b"y" * 40
+    assert cache.size() == 40 == disk_size(cache)
+
+
+def test_disk_cache_size_with_concurrent_writers(tmp_path):
+    cache = caches.DiskCache(str(tmp_path), 1 << 20)
+
+    def write(n: int) -> None:
+        for i in range(50):
+            cache.put(f"k{i % 10}", bytes(n))
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in (10, 20, 30, 40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert cache.size() == disk_size(cache)
+
+
+def test_disk_cache_evicts_to_budget(tmp_path):
+    cache = caches.DiskCache(str(tmp_path), 1000)
+    for i in range(20):
+        cache.put(f"k{i:02d}", bytes(100))
+
+    assert cache.size() == disk_size(cache) <= 1000
+    assert cache.get("k19") is not None
+
+
+def test_disk_cache_put_later(tmp_path):
+    cache = caches.DiskCache(str(tmp_path), 1 << 20)
+    done = threading.Event()
+
+    def encode() -> bytes:
+        done.set()
+        return b"data"
+
+    cache.put_later("aa-key", encode)
+    assert done.wait(5)
+    cache._writes.join()
+    assert cache.get("aa-key") == b"data"
+
+
+def test_raster_round_trip():
+    rng = np.random.default_rng(0)
+    for mode, shape in [("RGB", (30, 40, 3)), ("L", (30, 40))]:
+        image = Image.fromarray(rng.integers(0, 255, shape, dtype=np.uint8))
+        data = core.raster_to_bytes(image)
+        restored = core.raster_from_bytes(data)
+
+        assert restored.mode == mode
+        assert restored.size == (40, 30)
+        assert restored.tobytes() == image.tobytes()
+
+
+def test_deferred_writes_read_through_and_collect(tmp_path, monkeypatch):
+    cache = caches.DiskCache(str(tmp_path), 1 << 20)
+    deferred = caches.DeferredWrites(cache)
+
+    pdf = pymupdf.open()
+    pdf.new_page().insert_text((72, 72), "Hello OCR")
+    # Stand in for Tesseract: the OCR cache path is what is under test.
+    get_textpage = core.get_textpage
+    monkeypatch.setattr(
+        core, "get_textpage",
+        lambda pdf, i, flags, ocr_mode: get_textpage(pdf, i, flags, "off"),
+    )
+
+    rects = core.extract_page(pdf, 0, 0, "auto", cache=deferred)
+    writes = deferred.take()
+    assert len(writes) == 1 and deferred.take() == []
+    assert cache.size() == 0
+
+    key, data = writes[0]
+    cache.put(key, data)
+    cached = core.extract_page(pdf, 0, 0, "auto", cache=deferred)
+    assert deferred.take() == []
+    assert np.array_equal(cached["words"]["bbox"], rects["words"]["bbox"])
@@ -0,0 +1,135 @@
+import json
+import os
+
+import pymupdf
+
+import cli
+import core
+import workers
+
+
+class InlinePool:
+    """
+    Runs extraction in this process and fails the pages listed in fail.
+    """
+
+    size = 1
+
+    def __init__(self, fail: set[int] = frozenset()):
+        self.fail = fail
+        self.calls: list[int] = []
+
+    def extract(self, doc, page_index, flags, ocr_mode, *, chars=False):
+        self.calls.append(page_index)
+        if page_index in self.fail:
+            raise workers.PageError("failed", "boom")
+        with core.open_document(doc["path"]) as pdf:
+            return core.extract_page(pdf, page_index, flags, ocr_mode, chars=chars)
+
+    def release(self, doc_hashes):
+        pass
+
+
+def make_pdf(path, pages: int = 3, text: str = "Hello") -> str:
+    pdf = pymupdf.open()
+    for i in range(pages):
+        pdf.new_page().insert_text((72, 72), f"{text} {i}")
+    pdf.save(str(path))
+    return str(path)
+
+
+def run_jsonl(paths, output, pool, *, resume=False) -> int:
+    sink = cli.JsonlSink(str(output), resume=resume)
+    try:
+        return cli.extract_corpus(paths, sink, 0, "off", pool, progress=False)
+    finally:
+        sink.close()
+
+
+def read_jsonl(path) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_jsonl_resume_retries_failed_pages(tmp_path):
+    pdf = make_pdf(tmp_path / "a.pdf")
+    output = tmp_path / "out.jsonl"
+
+    assert run_jsonl([pdf], output, InlinePool(fail={1})) == 1
+    assert ["error" in r for r in read_jsonl(output)] == [False, True, False]
+
+    pool = InlinePool()
+    assert run_jsonl([pdf], output, pool, resume=True) == 0
+    assert pool.calls == [1]
+
+    records = read_jsonl(output)
+    assert sorted(r["page"] for r in records) == [0, 1, 2]
+    assert not any("error" in r for r in records)
+
+
+def test_jsonl_resume_retries_unopenable_documents(tmp_path):
+    bad = tmp_path / "bad.pdf"
+    bad.write_bytes(b"not a pdf")
+    output = tmp_path / "out.jsonl"
+
+    assert run_jsonl([str(bad)], output, InlinePool()) == 1
+    assert read_jsonl(output)[0]["page"] is None
+
+    make_pdf(bad, pages=2)
+    assert run_jsonl([str(bad)], output, InlinePool(), resume=True) == 0
+    assert [r["page"] for r in read_jsonl(output)] == [0, 1]
+
+
+def test_jsonl_resume_redoes_changed_documents(tmp_path):
+    pdf = make_pdf(tmp_path / "a.pdf", text="Old")
+    other = make_pdf(tmp_path / "b.pdf", pages=1)
+    output = tmp_path / "out.jsonl"
+    run_jsonl([pdf, other], output, InlinePool())
+
+    make_pdf(pdf, pages=2, text="New")
+    st = os.stat(pdf)
+    os.utime(pdf, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    pool = InlinePool()
+    run_jsonl([pdf, other], output, pool, resume=True)
+    assert pool.calls == [0, 1]
+
+    records = read_jsonl(output)
+    assert [(r["path"], r["page"]) for r in records] == [(other, 0), (pdf, 0), (pdf, 1)]
+    assert records[1]["spans"]["text"] == ["New 0"]
+
+
+def test_jsonl_resume_truncates_a_cut_off_line(tmp_path):
+    pdf = make_pdf(tmp_path / "a.pdf")
+    output = tmp_path / "out.jsonl"
+    run_jsonl([pdf], output, InlinePool())
+
+    data = output.read_bytes()
+    output.write_bytes(data[: len(data) - 10])
+
+    pool = InlinePool()
+    run_jsonl([pdf], output, pool, resume=True)
+    assert pool.calls == [2]
+    assert [r["page"] for r in read_jsonl(output)] == [0, 1, 2]
+
+
+def test_parquet_resume_redoes_documents_with_errors(tmp_path):
+    pdf = make_pdf(tmp_path / "a.pdf")
+    output = tmp_path / "out"
+
+    def run(pool, resume):
+        sink = cli.ParquetSink(str(output), resume=resume)
+        try:
+            return cli.extract_corpus([pdf], sink, 0, "off", pool, progress=False)
+        finally:
+            sink.close()
+
+    assert run(InlinePool(fail={2}), False) == 1
+
+    pool = InlinePool()
+    assert run(pool, True) == 0
+    assert pool.calls == [0, 1, 2]
+
+    pool = InlinePool()
+    run(pool, True)
+    assert pool.calls == []
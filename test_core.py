@@ -0,0 +1,148 @@
+import numpy as np
+import pymupdf
+
+import core
+
+
+def boxes(*rows) -> np.ndarray:
+    return np.array(rows, dtype=np.float32).reshape(-1, 4)
+
+
+def random_boxes(rng, n: int, page: float = 600.0) -> np.ndarray:
+    x0 = rng.uniform(0, page, n)
+    y0 = rng.uniform(0, page, n)
+    w = rng.uniform(2, 40, n)
+    h = rng.uniform(2, 15, n)
+    return np.stack([x0, y0, x0 + w, y0 + h], axis=1).astype(np.float32)
+
+
+def brute_mutual_best(a: np.ndarray, b: np.ndarray, min_iou: float) -> set:
+    iou = core.box_iou(core._solid(a), core._solid(b))
+    row_best = iou.argmax(axis=1)
+    col_best = iou.argmax(axis=0)
+    return {
+        (i, int(j))
+        for i, j in enumerate(row_best)
+        if col_best[j] == i and iou[i, j] >= min_iou
+    }
+
+
+def pairs(ia, ib) -> set:
+    return set(zip(ia.tolist(), ib.tolist()))
+
+
+def test_match_boxes_identical():
+    a = random_boxes(np.random.default_rng(0), 50)
+    ia, ib, iou = core.match_boxes(a, a[::-1])
+
+    assert pairs(ia, ib) == {(i, 49 - i) for i in range(50)}
+    assert np.allclose(iou, 1)
+
+
+def test_match_boxes_shifted_box():
+    a = boxes([0, 0, 10, 10], [20, 0, 30, 10])
+    b = boxes([0, 0, 10, 10], [21, 0, 31, 10])
+    ia, ib, iou = core.match_boxes(a, b)
+
+    assert pairs(ia, ib) == {(0, 0), (1, 1)}
+    assert np.isclose(iou[ia == 1][0], 9 / 11)
+
+    # Shifted past the threshold, the box no longer matches.
+    ia, ib, _ = core.match_boxes(a, boxes([0, 0, 10, 10], [26, 0, 36, 10]))
+    assert pairs(ia, ib) == {(0, 0)}
+
+
+def test_match_boxes_empty_sides():
+    a = boxes([0, 0, 10, 10])
+    empty = boxes()
+
+    for left, right in [(a, empty), (empty, a), (empty, empty)]:
+        ia, ib, iou = core.match_boxes(left, right)
+        assert len(ia) == len(ib) == len(iou) == 0
+
+
+def test_match_boxes_ties():
+    # Duplicates pair up one to one over repeated rounds.
+    a = boxes([0, 0, 10, 10], [0, 0, 10, 10], [0, 0, 10, 10])
+    b = boxes([0, 0, 10, 10], [0, 0, 10, 10])
+    ia, ib, _ = core.match_boxes(a, b)
+    assert len(set(ia.tolist())) == len(set(ib.tolist())) == 2
+
+    # A box halfway between two others matches exactly one of them.
+    a = boxes([0, 0, 10, 10], [4, 0, 14, 10])
+    b = boxes([2, 0, 12, 10])
+    ia, ib, _ = core.match_boxes(a, b, min_iou=0.1)
+    assert len(ia) == 1 and ib.tolist() == [0]
+
+
+def test_mutual_best_across_chunk_boundary():
+    # One tall box in b overlaps rows of a on both sides of the first
+    # MATCH_CHUNK boundary; its best match is in the second chunk.
+    n = core.MATCH_CHUNK + 10
+    y = np.arange(n, dtype=np.float32) * 10
+    a = np.stack([np.zeros(n), y, np.full(n, 10), y + 10], axis=1).astype(np.float32)
+    edge = core.MATCH_CHUNK * 10
+    b = boxes([0, edge - 8, 10, edge + 12])
+
+    ia, ib, _ = core._mutual_best(a, b, 0.1)
+    assert pairs(ia, ib) == {(core.MATCH_CHUNK, 0)}
+
+
+def test_mutual_best_matches_brute_force():
+    rng = np.random.default_rng(1)
+    for n in (1, core.MATCH_CHUNK - 1, core.MATCH_CHUNK, core.MATCH_CHUNK * 2 + 3):
+        a = random_boxes(rng, n)
+        b = a + rng.normal(0, 2, a.shape).astype(np.float32)
+        b = np.concatenate([b, random_boxes(rng, n // 3)])
+        b = b[rng.permutation(len(b))]
+
+        ia, ib, _ = core._mutual_best(core._solid(a), core._solid(b), 0.5)
+        assert pairs(ia, ib) == brute_mutual_best(a, b, 0.5)
+
+
+def test_compare_rects_and_diff_counts():
+    base = {
+        "words": {"bbox": boxes([0, 0, 10, 10], [20, 0, 30, 10], [40, 0, 50, 10])},
+        "lines": {"bbox": boxes([0, 0, 50, 10])},
+    }
+    other = {
+        "words": {"bbox": boxes([20, 0, 30, 10], [41, 0, 51, 10], [0, 40, 10, 50])},
+    }
+    diff = core.compare_rects(base, other)
+
+    assert list(diff) == ["words"]
+    words = diff["words"]
+    assert words["removed"].tolist() == [0]
+    assert words["added"].tolist() == [2]
+    assert words["shifted"].tolist() == [1]
+    assert words["shifted_base"].tolist() == [2]
+    assert core.diff_counts(diff) == {"words": {"removed": 1, "added": 1, "shifted": 1}}
+
+
+def test_compare_rects_identical():
+    rects = {"spans": {"bbox": random_boxes(np.random.default_rng(2), 40)}}
+    diff = core.compare_rects(rects, rects)
+
+    assert core.diff_counts(diff) == {"spans": {"removed": 0, "added": 0, "shifted": 0}}
+
+
+def test_rects_bytes_round_trip():
+    pdf = pymupdf.open()
+    page = pdf.new_page()
+    page.insert_text((72, 72), "Hello wörld")
+    page.insert_text((72, 144), "Second line", fontsize=20)
+    rects = core.extract_page(pdf, 0, 0, "off", chars=True)
+
+    data = core.rects_to_bytes(rects)
+    restored = core.rects_from_bytes(data)  # np.load refuses pickled arrays
+
+    assert restored.keys() == rects.keys()
+    for level, cols in rects.items():
+        assert restored[level].keys() == cols.keys()
+        for name, col in cols.items():
+            assert restored[level][name].dtype == col.dtype
+            assert np.array_equal(restored[level][name], col)
+
+    strings = [col for cols in restored.values() for col in cols.values() if col.dtype.kind == "U"]
+    assert strings and all(col.dtype != object for col in strings)
+    assert restored["words"]["text"].tolist() == ["Hello", "wörld", "Second", "line"]
@@ -0,0 +1,88 @@
+import numpy as np
+
+import spatial
+
+
+def random_boxes(rng, n: int) -> np.ndarray:
+    x0 = rng.uniform(0, 600, n)
+    y0 = rng.uniform(0, 800, n)
+    w = rng.exponential(20, n)
+    h = rng.exponential(8, n)
+    return np.stack([x0, y0, x0 + w, y0 + h], axis=1).astype(np.float32)
+
+
+def test_grid_index_csr_build():
+    boxes = random_boxes(np.random.default_rng(0), 300)
+    index = spatial.GridIndex(boxes)
+
+    assert len(index.starts) == index.cols * index.rows + 1
+    assert index.starts[0] == 0 and index.starts[-1] == len(index.items)
+    assert np.all(np.diff(index.starts) >= 0)
+
+    # Every box is listed once in each cell it covers, and nowhere else.
+    cx0, cy0 = index._cells(boxes[:, 0], boxes[:, 1])
+    cx1, cy1 = index._cells(boxes[:, 2], boxes[:, 3])
+    for cell in range(index.cols * index.rows):
+        cy, cx = divmod(cell, index.cols)
+        expected = np.flatnonzero((cx0 <= cx) & (cx <= cx1) & (cy0 <= cy) & (cy <= cy1))
+        assert index.items[index.starts[cell]:index.starts[cell + 1]].tolist() == expected.tolist()
+
+
+def test_grid_index_caps_cells_per_box():
+    # Tiny boxes far apart would otherwise need millions of cells.
+    boxes = np.array([[0, 0, 1, 1], [5000, 5000, 5001, 5001], [9999, 0, 10000, 1]], dtype=np.float32)
+    index = spatial.GridIndex(boxes)
+
+    limit = len(boxes) * spatial.MAX_CELLS_PER_BOX
+    assert index.cols * index.rows <= (np.sqrt(limit) + 2) ** 2
+    assert index.query_point(5000.5, 5000.5).tolist() == [1]
+    assert index.query_region(9000, 0, 10000, 10).tolist() == [2]
+
+
+def test_grid_index_empty():
+    index = spatial.GridIndex(np.zeros((0, 4), dtype=np.float32))
+
+    assert len(index) == 0
+    assert len(index.query_point(1, 1)) == 0
+    assert len(index.query_region(0, 0, 10, 10)) == 0
+
+
+def test_query_point_smallest_first():
+    boxes = np.array(
+        [
+            [0, 0, 100, 100],  # block
+            [10, 10, 20, 20],  # word
+            [0, 0, 100, 30],  # line
+            [10, 10, 20, 20],  # same word again
+            [50, 50, 60, 60],  # elsewhere
+        ],
+        dtype=np.float32,
+    )
+    index = spatial.GridIndex(boxes)
+
+    assert index.query_point(15, 15).tolist() == [1, 3, 2, 0]
+    assert index.query_point(55, 55).tolist() == [4, 0]
+    assert index.query_point(200, 200).tolist() == []
+
+
+def test_queries_match_brute_force():
+    rng = np.random.default_rng(1)
+    boxes = random_boxes(rng, 2000)
+    index = spatial.GridIndex(boxes)
+    x0, y0, x1, y1 = boxes.T
+
+    for _ in range(200):
+        qx0, qy0 = rng.uniform(-50, 650), rng.uniform(-50, 850)
+        qx1, qy1 = qx0 + rng.exponential(60), qy0 + rng.exponential(60)
+
+        hit = (x0 <= qx1) & (x1 >= qx0) & (y0 <= qy1) & (y1 >= qy0)
+        inside = (x0 >= qx0) & (x1 <= qx1) & (y0 >= qy0) & (y1 <= qy1)
+        assert index.query_region(qx0, qy0, qx1, qy1).tolist() == np.flatnonzero(hit).tolist()
+        assert (
+            index.query_region(qx0, qy0, qx1, qy1, contained=True).tolist()
+            == np.flatnonzero(inside).tolist()
+        )
+
+        at = np.flatnonzero((x0 <= qx0) & (qx0 <= x1) & (y0 <= qy0) & (qy0 <= y1))
+        area = (x1[at] - x0[at]) * (y1[at] - y0[at])
+        assert index.query_point(qx0, qy0).tolist() == at[np.argsort(area, kind="stable")].tolist()
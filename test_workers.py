@@ -0,0 +1,83 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+import types
+
+import pymupdf
+
+import core
+import workers
+
+
+def make_doc(text: str = "Hello") -> dict:
+    pdf = pymupdf.open()
+    pdf.new_page().insert_text((72, 72), text)
+    data = pdf.tobytes()
+    return {"name": "test.pdf", "hash": core.content_hash(data), "bytes": data}
+
+
+def test_workers_import_without_streamlit():
+    code = "import sys, workers; print('streamlit' in sys.modules)"
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert out.stdout.strip() == "False"
+
+
+def test_worker_does_not_rerun_main_script(tmp_path, monkeypatch):
+    # Under `streamlit run`, __main__ is the app script: a module with a
+    # __file__ and no __spec__.
+    marker = tmp_path / "ran"
+    script = tmp_path / "app.py"
+    script.write_text(
+        "import streamlit\n"
+        f"open({str(marker)!r}, 'w').close()\n"
+    )
+    main = types.ModuleType("__main__")
+    main.__file__ = str(script)
+    main.__spec__ = None
+    monkeypatch.setitem(sys.modules, "__main__", main)
+
+    pool = workers.WorkerPool(1, timeout=30)
+    rects = pool.extract(make_doc(), 0, 0, "off")
+
+    assert len(rects["words"]["bbox"]) == 1
+    assert not marker.exists()
+    assert sys.modules["__main__"] is main
+
+
+def test_background_tasks_leave_a_worker_for_the_foreground(monkeypatch):
+    release = threading.Event()
+
+    def call(self, doc, task, timeout):
+        if task[0] == "slow":
+            release.wait(5)
+        return task[0]
+
+    monkeypatch.setattr(workers._Worker, "start", lambda self: None)
+    monkeypatch.setattr(workers._Worker, "call", call)
+    pool = workers.WorkerPool(1)
+
+    def prefetch():
+        with pool.background():
+            pool.run({}, ("slow",))
+
+    threads = [threading.Thread(target=prefetch) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+
+    start = time.perf_counter()
+    assert pool.run({}, ("fast",)) == "fast"
+    assert time.perf_counter() - start < 1
+
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert pool._started == 2
@@ -0,0 +1,357 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Iterator
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import types
+
+from PIL import Image
+
+import caches
+import core
+import instrument
+
+POOL_SIZE = int(os.environ.get("PDF_INSPECTOR_WORKERS", os.cpu_count() or 1))
+
+PAGE_TIMEOUT = float(os.environ.get("PDF_INSPECTOR_PAGE_TIMEOUT", "60"))
+
+WORKER_MEMORY_MB = int(os.environ.get("PDF_INSPECTOR_WORKER_MEMORY_MB", "4096"))
+
+WORKER_DOCS = 4  # open documents kept per worker process
+
+
+class PageError(Exception):
+    """
+    A page task did not complete in its worker process.
+
+    status is "timeout" when the task ran past its time limit and "failed"
+    when it raised or the worker process died.
+    """
+
+    def __init__(self, status: str, message: str):
+        super().__init__(message)
+        self.status = status
+
+    def __str__(self) -> str:
+        return f"{self.status}: {super().__str__()}"
+
+
+def _limit_memory(memory_mb: int) -> None:
+    if memory_mb <= 0:
+        return
+
+    try:
+        import resource
+    except ImportError:
+        return
+
+    limit = memory_mb * 1024 * 1024
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError):
+        pass
+
+
+_START_LOCK = threading.Lock()
+
+
+def _start_process(process: multiprocessing.process.BaseProcess) -> None:
+    """
+    Start a spawned process without re-running the parent's __main__.
+
+    Spawn re-imports the parent's main script in the child. Under
+    `streamlit run` that is the app script, which would load Streamlit and
+    run the whole app in every worker, so a stub __main__ with no file is
+    installed while the child's start-up data is taken.
+    """
+    with _START_LOCK:
+        main = sys.modules.get("__main__")
+        stub = sys.modules["__main__"] = types.ModuleType("__main__")
+        try:
+            process.start()
+        finally:
+            # Leave it alone if a script run replaced it in the meantime.
+            if sys.modules.get("__main__") is stub and main is not None:
+                sys.modules["__main__"] = main
+
+
+def _run_task(docs: dict, task: tuple, ocr_cache: caches.DeferredWrites) -> Any:
+    op, doc_hash, *args = task
+    pdf = docs[doc_hash]
+    if isinstance(pdf, Exception):
+        raise pdf
+
+    if op == "extract":
+        page_index, flags, ocr_mode, chars = args
+        return core.extract_page(
+            pdf, page_index, flags, ocr_mode, cache=ocr_cache, chars=chars,
+        )
+
+    if op == "render":
+        page_index, dpi, clip, colorspace = args
+        return core.render_pixels(pdf, page_index, dpi, clip=clip, colorspace=colorspace)
+
+    raise ValueError(f"Invalid task: {op}")
+
+
+def _worker_main(conn, memory_mb: int) -> None:
+    """
+    Worker process loop: open and close documents, run page tasks.
+
+    OCR cache writes are sent back with each result for the pool's process
+    to make.
+    """
+    _limit_memory(memory_mb)
+    docs: dict = {}
+    ocr_cache = caches.DeferredWrites(caches.OCR_CACHE)
+
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            return
+
+        if msg[0] == "open":
+            try:
+                docs[msg[1]] = core.open_document(msg[2])
+            except Exception as exc:
+                docs[msg[1]] = exc  # reported by each task on the document
+            continue
+
+        if msg[0] == "close":
+            pdf = docs.pop(msg[1], None)
+            if pdf is not None and not isinstance(pdf, Exception):
+                pdf.close()
+            continue
+
+        try:
+            result = _run_task(docs, msg, ocr_cache)
+        except Exception as exc:
+            conn.send(("error", f"{type(exc).__name__}: {exc}", ocr_cache.take()))
+        else:
+            conn.send(("ok", result, ocr_cache.take()))
+
+
+class _Worker:
+    """
+    Supervisor-side handle for one worker process.
+
+    Mirrors the worker's open documents so each document is sent to a
+    worker once, and evicts the least recently used beyond WORKER_DOCS.
+    Documents are sent as their bytes, or as their file path when the doc
+    has a "path" instead.
+    """
+
+    def __init__(self, ctx, memory_mb: int):
+        self._ctx = ctx
+        self._memory_mb = memory_mb
+        self.start()
+
+    def start(self) -> None:
+        self.conn, child = self._ctx.Pipe()
+        self.process = self._ctx.Process(
+            target=_worker_main,
+            args=(child, self._memory_mb),
+            name="pdf-inspector-worker",
+            daemon=True,
+        )
+        _start_process(self.process)
+        child.close()
+        self.docs: OrderedDict[str, None] = OrderedDict()
+
+    def restart(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+        self.start()
+
+    def close_documents(self, doc_hashes: set[str]) -> None:
+        for doc_hash in [h for h in self.docs if h in doc_hashes]:
+            del self.docs[doc_hash]
+            self.conn.send(("close", doc_hash))
+
+    def call(self, doc: dict, task: tuple, timeout: float) -> Any:
+        try:
+            self._ensure_open(doc)
+            self.conn.send((task[0], doc["hash"], *task[1:]))
+            if not self.conn.poll(timeout):
+                raise PageError("timeout", f"no result after {timeout:g}s")
+            status, result, ocr_writes = self.conn.recv()
+        except (EOFError, OSError):
+            self.process.join(1)
+            raise PageError(
+                "failed",
+                f"worker process died (exit code {self.process.exitcode})",
+            )
+
+        for key, data in ocr_writes:
+            caches.OCR_CACHE.put(key, data)
+
+        if status == "error":
+            raise PageError("failed", result)
+        return result
+
+    def _ensure_open(self, doc: dict) -> None:
+        doc_hash = doc["hash"]
+        if doc_hash in self.docs:
+            self.docs.move_to_end(doc_hash)
+            return
+
+        while len(self.docs) >= WORKER_DOCS:
+            evicted, _ = self.docs.popitem(last=False)
+            self.conn.send(("close", evicted))
+
+        source = doc["bytes"] if "bytes" in doc else doc["path"]
+        self.conn.send(("open", doc_hash, source))
+        self.docs[doc_hash] = None
+
+
+class WorkerPool:
+    """
+    Supervised pool of worker processes that run all PyMuPDF page work.
+
+    - Each task gets a per-page time limit; a worker that runs past it is
+      killed and replaced, and the task raises PageError("timeout").
+    - Workers run under an address-space limit of memory_mb (POSIX only).
+    - A worker that crashes is replaced; its task raises PageError("failed").
+    - Workers are started on first use, up to size.
+    - Tasks run inside background() (prefetching) hold at most
+      background_limit workers, and the pool keeps one more for other
+      tasks, so the page on screen never waits behind background work.
+      A pool of one starts a second worker for this.
+    """
+
+    def __init__(
+        self,
+        size: int = POOL_SIZE,
+        *,
+        timeout: float = PAGE_TIMEOUT,
+        memory_mb: int = WORKER_MEMORY_MB,
+    ):
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self._ctx = multiprocessing.get_context("spawn")
+        self.background_limit = max(1, self.size - 1)
+        self._capacity = max(self.size, self.background_limit + 1)
+        self._idle: queue.LifoQueue[_Worker] = queue.LifoQueue()
+        self._started = 0
+        self._lock = threading.Lock()
+        self._background = threading.Condition()
+        self._background_busy = 0
+        self._local = threading.local()
+
+    @contextmanager
+    def background(self) -> Iterator[None]:
+        """
+        Run the tasks the current thread submits in the background lane.
+        """
+        self._local.background = True
+        try:
+            yield
+        finally:
+            self._local.background = False
+
+    def _acquire(self) -> _Worker:
+        with self._lock:
+            if self._idle.empty() and self._started < self._capacity:
+                self._started += 1
+                return _Worker(self._ctx, self.memory_mb)
+        return self._idle.get()
+
+    def run(self, doc: dict, task: tuple, timeout: float | None = None) -> Any:
+        background = getattr(self._local, "background", False)
+        if background:
+            with self._background:
+                while self._background_busy >= self.background_limit:
+                    self._background.wait()
+                self._background_busy += 1
+
+        worker = self._acquire()
+        try:
+            with instrument.span(f"workers.{task[0]}"):
+                return worker.call(doc, task, timeout or self.timeout)
+        except PageError as exc:
+            if exc.status == "timeout" or not worker.process.is_alive():
+                worker.restart()
+            raise
+        finally:
+            self._idle.put(worker)
+            if background:
+                with self._background:
+                    self._background_busy -= 1
+                    self._background.notify()
+
+    def extract(
+        self,
+        doc: dict,
+        page_index: int,
+        flags: int,
+        ocr_mode: str,
+        *,
+        chars: bool = False,
+    ) -> dict:
+        return self.run(doc, ("extract", page_index, flags, ocr_mode, chars))
+
+    def render(
+        self,
+        doc: dict,
+        page_index: int,
+        dpi: int,
+        *,
+        clip: tuple[float, float, float, float] | None = None,
+        colorspace: str = "rgb",
+    ) -> Image.Image:
+        return core.image_from_pixels(
+            self.run(doc, ("render", page_index, dpi, clip, colorspace))
+        )
+
+    def render_pages(
+        self,
+        doc: dict,
+        page_indices: list[int],
+        dpi: int,
+        *,
+        colorspace: str = "rgb",
+    ) -> list[Image.Image | PageError]:
+        """
+        Render pages in parallel across the pool, in page order.
+
+        Failed pages are returned as their PageError instead of raising.
+        """
+        def render_one(page_index: int) -> Image.Image | PageError:
+            try:
+                return self.render(doc, page_index, dpi, colorspace=colorspace)
+            except PageError as exc:
+                return exc
+
+        if len(page_indices) <= 1:
+            return [render_one(i) for i in page_indices]
+
+        with ThreadPoolExecutor(max_workers=min(self.size, len(page_indices))) as ex:
+            return list(ex.map(render_one, page_indices))
+
+    def release(self, doc_hashes: set[str]) -> None:
+        """
+        Close documents in idle workers; busy workers evict them by LRU later.
+        """
+        idle = []
+        while True:
+            try:
+                idle.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+        for worker in idle:
+            try:
+                worker.close_documents(doc_hashes)
+            except OSError:
+                worker.restart()
+            self._idle.put(worker)
+
+
+POOL = WorkerPool()